@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+"""Compare two outputs of `quaint bench`
+
+Usage:
+  compare.py OLD NEW [-t THRESHOLD] [-s STAT]
+
+Arguments:
+  OLD           JSON output of a previous run of quaint bench.
+  NEW           JSON output of the run to check.
+
+Options:
+  -h --help     Show this screen.
+  -t THRESHOLD  Relative slowdown reported as a regression [default: 0.2].
+  -s STAT       Statistic to compare (min, median or max) [default: min].
+"""
+
+from docopt import docopt
+import json
+
+
+def index(results):
+    return {entry['name']: entry for entry in results['inputs']}
+
+
+def compare(old, new, threshold, stat):
+    old = index(old)
+    regressions = []
+    for name, entry in sorted(index(new).items()):
+        if name not in old:
+            continue
+        for phase, times in sorted(entry['phases'].items()):
+            before = old[name]['phases'].get(phase, {}).get(stat)
+            after = times[stat]
+            if before and after > before * (1 + threshold):
+                regressions.append((name, phase, before, after))
+    return regressions
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+
+    regressions = compare(json.load(open(args['OLD'])),
+                          json.load(open(args['NEW'])),
+                          float(args['-t']),
+                          args['-s'])
+
+    for name, phase, before, after in regressions:
+        print("{name} [{phase}]: {before:.4f}s -> {after:.4f}s ({ratio:+.0%})".format(
+                name = name, phase = phase, before = before, after = after,
+                ratio = after / before - 1))
+
+    exit(1 if regressions else 0)
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+"""Check that every rendering phase scales at most like n log n
+
+Renders inputs of geometrically increasing sizes, fits the growth
+exponent of each phase (the slope of log(time) against log(size)) and
+fails if any of them grows faster than n log n, plus some tolerance.
+`pytest --slow tests/test_scaling.py` runs the same check on smaller
+sizes.
+
+Usage:
+  scaling.py [-s SHAPES] [-n SIZE] [-k STEPS] [-r REPEAT] [-t TOL] [--json]
+
+Options:
+  -h --help     Show this screen.
+  -s SHAPES     Comma-separated shapes to render (default: all of them).
+  -n SIZE       Smallest size [default: 50].
+  -k STEPS      Number of sizes, each twice the previous [default: 4].
+  -r REPEAT     Number of timed runs for each size (the minimum is kept) [default: 3].
+  -t TOL        Tolerance over the n log n exponent [default: 0.15].
+  --json        Output the results as JSON.
+"""
+
+from docopt import docopt
+from math import log
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from quaint.operparse import Source
+from quaint.builders import default_engine
+from quaint.interface import fullhtml_template
+from quaint import bench
+
+
+# Phases that never take longer than this (in seconds) are too noisy
+# to fit and are too cheap to matter.
+noise_floor = 0.005
+
+
+def generate_list(size):
+    return "\n".join("* item {i}\n  * nested {i}".format(i = i)
+                     for i in range(size))
+
+def generate_table(size):
+    return "+ Index + Name +\n" + "\n".join(
+        "| {i} | row {i} |".format(i = i) for i in range(size))
+
+def generate_definitions(size):
+    return "\n".join("term {i} := definition {i}".format(i = i)
+                     for i in range(size))
+
+def generate_links(size):
+    return "\n\n".join(
+        "Section {i}\n----------\n\n"
+        "See [section {j}]::section-{j} and link::http://example.com/{i}.".format(
+            i = i, j = (i * 7) % size)
+        for i in range(size))
+
+shapes = dict(
+    sections = bench.generate_corpus,
+    list = generate_list,
+    table = generate_table,
+    definitions = generate_definitions,
+    links = generate_links,
+    )
+
+
+def measure(text, directory, repeat):
+    path = os.path.join(directory, 'scaling.py.q')
+    with open(path, 'w') as f:
+        f.write(text)
+    best = {}
+    for i in range(repeat):
+        timings = bench.time_phases(Source(text, url = path), default_engine())
+        for phase, t in timings.items():
+            best[phase] = min(t, best.get(phase, t))
+    return best
+
+def fit_exponent(sizes, times):
+    # Least-squares slope of log(time) against log(size)
+    xs = [log(n) for n in sizes]
+    ys = [log(max(t, 1e-9)) for t in times]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    return (sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+            / sum((x - mx) ** 2 for x in xs))
+
+def nlogn_exponent(sizes):
+    return fit_exponent(sizes, [n * log(n) for n in sizes])
+
+def check_shape(shape, sizes, repeat, tolerance):
+    """
+    Render the given shape at each size and return a dictionary
+    mapping each phase to (exponent, ok), where exponent is None if
+    the phase is too fast to be measured reliably.
+    """
+    directory = tempfile.mkdtemp(prefix = 'quaint-scaling-')
+    try:
+        with open(os.path.join(directory, 'snippet.q'), 'w') as f:
+            f.write(bench.include_snippet)
+        samples = [measure(shapes[shape](n), directory, repeat) for n in sizes]
+    finally:
+        shutil.rmtree(directory)
+
+    limit = nlogn_exponent(sizes) + tolerance
+    results = {}
+    for phase in bench.phases:
+        times = [s[phase] for s in samples]
+        if max(times) < noise_floor:
+            results[phase] = (None, True)
+        else:
+            exponent = fit_exponent(sizes, times)
+            results[phase] = (exponent, exponent <= limit)
+    return results
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+
+    sys.setrecursionlimit(10000)
+    fullhtml_template()
+
+    names = args['-s'].split(",") if args['-s'] else sorted(shapes)
+    sizes = [int(args['-n']) * 2 ** k for k in range(int(args['-k']))]
+    tolerance = float(args['-t'])
+
+    failures = []
+    report = {}
+    for shape in names:
+        results = check_shape(shape, sizes, int(args['-r']), tolerance)
+        report[shape] = {phase: exponent
+                         for phase, (exponent, ok) in results.items()}
+        for phase, (exponent, ok) in results.items():
+            if not ok:
+                failures.append((shape, phase, exponent))
+
+    if args['--json']:
+        print(json.dumps({'sizes': sizes,
+                          'limit': nlogn_exponent(sizes) + tolerance,
+                          'exponents': report},
+                         indent = 2, sort_keys = True))
+    else:
+        print("sizes: %s, limit: %.2f" % (sizes, nlogn_exponent(sizes) + tolerance))
+        for shape in names:
+            print(shape)
+            for phase in bench.phases:
+                exponent = report[shape][phase]
+                print("  %-18s %s" % (phase, "-" if exponent is None
+                                      else "%.2f" % exponent))
+
+    for shape, phase, exponent in failures:
+        print("FAIL: %s [%s] grows like n^%.2f" % (shape, phase, exponent),
+              file = sys.stderr)
+
+    exit(1 if failures else 0)
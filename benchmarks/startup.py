@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+"""Check the startup time of the quaint command
+
+Runs `quaint html -s` on a tiny document (and `import quaint`) in
+fresh interpreters, reports the fastest and the median time and fails
+if the fastest run of the command exceeds the budget.
+
+Usage:
+  startup.py [-r REPEAT] [-b BUDGET] [-i COUNT] [--json]
+
+Options:
+  -h --help     Show this screen.
+  -r REPEAT     Number of runs of each command [default: 10].
+  -b BUDGET     Maximal startup time of the command, in seconds [default: 0.25].
+  -i COUNT      List the COUNT modules that take the longest to import.
+  --json        Output the results as JSON.
+"""
+
+from docopt import docopt
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script = os.path.join(root, 'bin', 'quaint')
+
+commands = dict(
+    import_quaint = [sys.executable, '-c', 'import quaint'],
+    html = [sys.executable, script, 'html', '-s', 'Hello *world*'],
+    )
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    return env
+
+def measure(command, repeat):
+    env = environment()
+    # Once untimed, to write the bytecode and the pattern cache
+    subprocess.run(command, env = env, check = True, stdout = subprocess.DEVNULL)
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env = env, check = True, stdout = subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2]}
+
+def slowest_imports(command, count):
+    # -X importtime reports "self | cumulative | module" on stderr
+    result = subprocess.run(command[:1] + ['-X', 'importtime'] + command[1:],
+                            env = environment(), check = True,
+                            stdout = subprocess.DEVNULL, stderr = subprocess.PIPE,
+                            universal_newlines = True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, module = line[len('import time:'):].split('|')
+        entries.append((int(own), int(cumulative), module.strip()))
+    entries.sort(reverse = True)
+    return entries[:count]
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+
+    budget = float(args['-b'])
+    results = {name: measure(command, int(args['-r']))
+               for name, command in commands.items()}
+    imports = slowest_imports(commands['html'], int(args['-i'])) if args['-i'] else []
+
+    if args['--json']:
+        print(json.dumps({'budget': budget,
+                          'results': results,
+                          'imports': [{'module': module, 'self': own, 'cumulative': cumulative}
+                                      for own, cumulative, module in imports]},
+                         indent = 2, sort_keys = True))
+    else:
+        for name, times in sorted(results.items()):
+            print("%-14s min %.3fs  median %.3fs" % (name, times['min'], times['median']))
+        for own, cumulative, module in imports:
+            print("  %-40s %7.1fms (%.1fms cumulative)" % (module, own / 1000, cumulative / 1000))
+
+    failed = results['html']['min'] > budget
+    if failed:
+        print("FAIL: quaint html takes %.3fs to start (budget: %.3fs)"
+              % (results['html']['min'], budget), file = sys.stderr)
+
+    exit(1 if failed else 0)
@@ -5,4 +5,4 @@ from .parser import parse
 from .engine import Generator
 from .document import HTMLDocument, TextDocument
 from .builders import default_engine, q_engine, bare_engine
-from .interface import full_html, site, evaluate
+from .interface import full_html, site, site_stream, evaluate, full_html_async, site_async, html_files
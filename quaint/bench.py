@@ -0,0 +1,262 @@
+
+import gc
+import os
+import sys
+import json
+import shutil
+import tempfile
+from time import perf_counter
+from contextlib import contextmanager
+from .operparse import Source
+from .operparse.parse import operator_parse
+from .parser import tokenize, make_operators, finalize, order, fix_whitespace
+from .document import make_documents, execute_documents
+from .builders import default_engine, q_engine, html_name
+from .interface import site_node, make_engine, fullhtml_template, full_html
+
+pj = os.path.join
+
+
+phases = ('tokenize', 'make_operators', 'operator_parse', 'fix_whitespace',
+          'evaluate', 'execute_documents', 'format_html')
+
+
+########################
+### Synthetic corpus ###
+########################
+
+corpus_features = ('headers', 'lists', 'tables', 'code',
+                   'links', 'eval', 'include')
+
+include_snippet = """
+Included snippet
+----------------
+
+* Shared item with _emphasis
+* Another __[shared item]
+"""
+
+def corpus_section(i, features):
+    parts = []
+    if 'headers' in features:
+        parts.append("Section {i}\n==========".format(i = i))
+    parts.append("Some _emphasized text and __[strong text] in section {i}.\n"
+                 "It continues on a second line.".format(i = i))
+    if 'lists' in features:
+        parts.append("* item {i}.1\n"
+                     "* item {i}.2\n"
+                     "  * nested {i}.2.1\n"
+                     "  * nested {i}.2.2\n"
+                     "* item {i}.3".format(i = i))
+    if 'tables' in features:
+        parts.append("+ Name + Value +\n"
+                     "| a{i} | {i} |\n"
+                     "| b{i} | {j} |".format(i = i, j = i * 2))
+    if 'code' in features:
+        parts.append("python %\n"
+                     "  def f{i}(x):\n"
+                     "      return x + {i}".format(i = i))
+    if 'links' in features:
+        target = "section-{i}".format(i = max(i - 1, 0))
+        parts.append("A link::http://example.com/{i} and "
+                     "[a section]::{target}.".format(i = i, target = target))
+    if 'eval' in features:
+        parts.append("Computed: {{{i} * 2}}".format(i = i))
+    if 'include' in features:
+        parts.append("{include}: snippet.q")
+    return "\n\n".join(parts)
+
+def generate_corpus(size, features = corpus_features):
+    """
+    Generate a Quaint document made of `size` sections, each of which
+    exercises the given features. The 'include' feature refers to
+    snippet.q, which write_corpus puts next to the document.
+    """
+    return "\n\n\n".join(corpus_section(i, features) for i in range(size))
+
+def write_corpus(directory, size, features = corpus_features):
+    path = pj(directory, 'corpus-%s.py.q' % size)
+    with open(path, 'w') as f:
+        f.write(generate_corpus(size, features))
+    with open(pj(directory, 'snippet.q'), 'w') as f:
+        f.write(include_snippet)
+    return path
+
+
+########################
+### Real-world input ###
+########################
+
+def source_root():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.path.isdir(pj(root, 'doc', 'content')):
+        return root
+    else:
+        return None
+
+def real_world_inputs(root = None):
+    """
+    List (name, path, template, extensions) for the documentation and
+    the examples in a source checkout. Returns an empty list if no
+    checkout can be found.
+    """
+    root = root or source_root()
+    if root is None:
+        return []
+
+    results = []
+    docroot = pj(root, 'doc', 'content')
+    template = pj(docroot, '@template.py.q')
+    doc_extensions = [('use_assets', ['/assets/']),
+                      ('siteroot', ['/']),
+                      ('extend_environment', [{'html_name': html_name}])]
+    for dirpath, dirnames, filenames in sorted(os.walk(docroot)):
+        for name in sorted(filenames):
+            if name.endswith('.q') and not name.startswith('@'):
+                path = pj(dirpath, name)
+                results.append((os.path.relpath(path, root), path,
+                                template, doc_extensions))
+
+    exroot = pj(root, 'examples')
+    for name in sorted(os.listdir(exroot)):
+        if name.endswith('.q'):
+            path = pj(exroot, name)
+            results.append((os.path.relpath(path, root), path, None, []))
+
+    return results
+
+
+##############
+### Timing ###
+##############
+
+def engine_for(path, template = None):
+    # Pages with a template are rendered like quaint site does
+    if template is not None or path.endswith('.py.q'):
+        return default_engine()
+    else:
+        return q_engine()
+
+@contextmanager
+def in_directory(path):
+    # Examples open their data files relative to their own directory
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(path)))
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+def read_inputs(path, template = None):
+    with open(path) as f:
+        text = f.read()
+    if template is not None:
+        with open(template) as f:
+            template = Source(f.read(), url = template)
+    return text, template
+
+def render(path, template = None, extensions = []):
+    """
+    Render the input at path as the benchmark does, and return the
+    html.
+    """
+    text, template = read_inputs(path, template)
+    engine = make_engine(engine_for(path, template), extensions)
+    with in_directory(path):
+        return full_html(Source(text, url = path), engine = engine,
+                         template = template)
+
+def time_phases(source, engine, template = None):
+    """
+    Render `source` like interface.full_html does, but one phase at
+    a time. Returns a dictionary mapping each phase to the time it
+    took, in seconds. Like timeit, the garbage collector is disabled
+    while a phase runs.
+    """
+    timings = {}
+
+    def timed(phase, f, *args):
+        gc.collect()
+        gc.disable()
+        try:
+            start = perf_counter()
+            result = f(*args)
+            timings[phase] = perf_counter() - start
+        finally:
+            gc.enable()
+        return result
+
+    tokens = timed('tokenize', lambda: list(tokenize(source)))
+    operators = timed('make_operators',
+                      lambda: list(make_operators(iter(tokens))))
+    ptree = timed('operator_parse', operator_parse,
+                  iter(operators), order, finalize)
+    ptree = timed('fix_whitespace',
+                  lambda: fix_whitespace(ptree, True, True)[0])
+
+    node = site_node([('result', ptree, template)])
+    gen = timed('evaluate', engine, node)
+
+    documents = make_documents('files', 'globalinfo')
+    timed('execute_documents', execute_documents, gen, documents)
+    timed('format_html', lambda: [doc.format_html()
+                                  for doc in documents['files'].data.values()])
+    return timings
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    if n % 2:
+        median = samples[n // 2]
+    else:
+        median = (samples[n // 2 - 1] + samples[n // 2]) / 2
+    return {'min': samples[0], 'median': median, 'max': samples[-1]}
+
+def bench_file(name, path, template = None, extensions = [], repeat = 5):
+    text, template = read_inputs(path, template)
+    samples = {phase: [] for phase in phases + ('total',)}
+    for i in range(repeat):
+        engine = make_engine(engine_for(path, template), extensions)
+        with in_directory(path):
+            timings = time_phases(Source(text, url = path), engine, template)
+        timings['total'] = sum(timings.values())
+        for phase, t in timings.items():
+            samples[phase].append(t)
+    return {'name': name,
+            'bytes': len(text.encode('utf-8')),
+            'lines': text.count("\n") + 1,
+            'phases': {phase: summarize(s) for phase, s in samples.items()}}
+
+def run(sizes = (10, 30, 100), features = corpus_features,
+        repeat = 5, real_world = True):
+    """
+    Run the benchmark suite: synthetic corpora of the given sizes,
+    then (optionally) the documentation and examples. Returns a
+    JSON-serializable dictionary.
+    """
+    # Parse the default template outside of the timed sections
+    fullhtml_template()
+
+    results = []
+    directory = tempfile.mkdtemp(prefix = 'quaint-bench-')
+    try:
+        for size in sizes:
+            path = write_corpus(directory, size, features)
+            results.append(bench_file('synthetic-%s' % size, path,
+                                      repeat = repeat))
+    finally:
+        shutil.rmtree(directory)
+
+    if real_world:
+        for name, path, template, extensions in real_world_inputs():
+            results.append(bench_file(name, path, template, extensions,
+                                      repeat = repeat))
+
+    return {'python': sys.version.split()[0],
+            'repeat': repeat,
+            'features': list(features),
+            'phases': list(phases),
+            'inputs': results}
+
+def dumps(results):
+    return json.dumps(results, indent = 2, sort_keys = True)
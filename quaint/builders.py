@@ -1,4 +1,5 @@
 
+import os
 from . import ast, lib, document, engine as mod_engine
 
 
@@ -117,6 +118,61 @@ def apply_bindings(bindings, engine):
 
 
 
+__snapshots = {}
+__pattern_trees_loaded = False
+
+def pattern_cache_path():
+    # Set QUAINT_PATTERN_CACHE to a file path to keep the parsed
+    # binding patterns across processes
+    return os.environ.get('QUAINT_PATTERN_CACHE') or None
+
+def new_engine(environment, bindings, error_handler = None, self_reference = True):
+    engine = mod_engine.Engine(error_handler)
+    engine.environment = environment()
+    apply_bindings(bindings, engine)
+    if self_reference:
+        engine.environment['engine'] = engine
+    return engine
+
+def engine_snapshot(environment, bindings, self_reference = True):
+    """
+    Return a frozen engine with the variables returned by
+    environment() and the rules in bindings. It is only built once for
+    each set of arguments (bindings are compared by value). If
+    self_reference is true, the `engine variable refers to the
+    engine.
+    """
+    global __pattern_trees_loaded
+    key = (environment, tuple(bindings), self_reference)
+    engine = __snapshots.get(key)
+    if engine is None:
+        path = pattern_cache_path()
+        stale = False
+        if path and not __pattern_trees_loaded:
+            # A file that cannot be loaded is replaced
+            stale = not mod_engine.load_pattern_trees(path)
+            __pattern_trees_loaded = True
+        known = len(mod_engine.pattern_trees)
+        engine = new_engine(environment, bindings, None, self_reference)
+        engine.freeze()
+        __snapshots[key] = engine
+        if path and (stale or len(mod_engine.pattern_trees) > known):
+            mod_engine.save_pattern_trees(path)
+    return engine
+
+def build_engine(environment, bindings, error_handler, self_reference = True):
+    # Engines are contexts of a snapshot, unless the bindings cannot
+    # be used as a key
+    try:
+        snapshot = engine_snapshot(environment, bindings, self_reference)
+    except TypeError:
+        return new_engine(environment, bindings, error_handler, self_reference)
+    engine = snapshot.context()
+    engine.error_handler = error_handler
+    return engine
+
+
+
 def bare_environment():
     safe = """text op paragraph blocks indent bracket juxt""".split()
     env = {}
@@ -126,10 +182,8 @@ def bare_environment():
 
 def bare_engine(error_handler = mod_engine.inline_error_handler,
                 bindings = bare_bindings):
-    engine = mod_engine.Engine(error_handler)
-    engine.environment = bare_environment()
-    apply_bindings(bindings, engine)
-    return engine
+    return build_engine(bare_environment, bindings, error_handler,
+                        self_reference = False)
 
 
 
@@ -142,11 +196,7 @@ def default_environment():
 
 def default_engine(error_handler = mod_engine.inline_error_handler,
                    bindings = default_bindings):
-    engine = mod_engine.Engine(error_handler)
-    engine.environment = default_environment()
-    apply_bindings(bindings, engine)
-    engine.environment['engine'] = engine
-    return engine
+    return build_engine(default_environment, bindings, error_handler)
 
 
 
@@ -155,14 +205,14 @@ def q_environment():
 paragraph blocks indent
 bracket parens
 em strong
-link special_link anchor
+link special_link qlink regqlink elink anchor
 code code_block
 header1 header2 header3 header4 header5 header6
 ulist olist dlist
 table_header table_row
 domnode quote ignore setvar load_in_var ifthenelse
 toc
-meta html css json yaml show_args include
+meta html css json yaml show_args include data_table
 insert_document
 """.split()
 
@@ -175,11 +225,7 @@ insert_document
 
 def q_engine(error_handler = mod_engine.inline_error_handler,
              bindings = default_bindings):
-    engine = mod_engine.Engine(error_handler)
-    engine.environment = q_environment()
-    apply_bindings(bindings, engine)
-    engine.environment['engine'] = engine
-    return engine
+    return build_engine(q_environment, bindings, error_handler)
 
 
 
@@ -207,6 +253,23 @@ class HTMLMetaNode(mod_engine.MetaNode):
         return engine(node)
 
 
+class PrefetchMetaNode(mod_engine.MetaNode):
+    # Fetch the data files loaded in main and in the other parse trees
+    # concurrently before evaluating node. Relative paths are resolved
+    # against main, as TemplateMetaNode does.
+    def process(self, engine, node, main, *others):
+        engine.environment['__file__'] = main.location.source.url
+        outer = engine.environment.get('__prefetched__')
+        lib.prefetch(engine, main, *others)
+        try:
+            return engine(node)
+        finally:
+            # Loads prefetched for several pages (see site_async) are
+            # left for the other pages
+            if outer is None:
+                engine.environment.pop('__prefetched__', None)
+
+
 
 
 def strip_ext(path):
@@ -217,6 +280,13 @@ def strip_ext(path):
     else:
         return path
 
+def html_name(outroot, path = None):
+    if path is None:
+        dest = outroot
+    else:
+        dest = os.path.join(outroot, path)
+    return strip_ext(dest) + '.html'
+
 class MultiMetaNode(mod_engine.MetaNode):
     def process(self, engine, docs, nodes):
         return MultiDocumentGenerator(
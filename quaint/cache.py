@@ -0,0 +1,284 @@
+
+import os
+import sys
+import threading
+import urllib.parse
+from collections import OrderedDict
+from .util import LazyModule
+
+urllib_request = LazyModule('urllib.request')
+
+
+class FrozenError(TypeError):
+    """
+    Raised when data loaded from a cached file (see DataCache) is
+    modified. thaw(data) returns a mutable copy of it.
+    """
+    pass
+
+def _frozen(self, *args, **kwargs):
+    raise FrozenError("Cached data is shared between documents and cannot"
+                      " be modified. Use thaw(data) to get a mutable copy,"
+                      " or set QUAINT_DATA_CACHE=0 to disable the cache.")
+
+
+class FrozenList(list):
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _frozen
+    append = extend = insert = pop = remove = clear = sort = reverse = _frozen
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [thaw(x) for x in self]
+
+
+class FrozenDict(dict):
+
+    __setitem__ = __delitem__ = __ior__ = _frozen
+    clear = pop = popitem = setdefault = update = _frozen
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {k: thaw(v) for k, v in self.items()}
+
+
+def freeze(data):
+    """
+    Return (frozen, size): an immutable version of data, where lists
+    and dictionaries are replaced by FrozenList and FrozenDict, and an
+    estimate of its size in memory, in bytes.
+    """
+    if isinstance(data, list):
+        results = []
+        size = sys.getsizeof(data)
+        for x in data:
+            x, s = freeze(x)
+            results.append(x)
+            size += s
+        return FrozenList(results), size
+    elif isinstance(data, dict):
+        results = {}
+        size = sys.getsizeof(data)
+        for k, v in data.items():
+            v, s = freeze(v)
+            results[k] = v
+            size += s + sys.getsizeof(k)
+        return FrozenDict(results), size
+    elif isinstance(data, set):
+        return frozenset(data), sys.getsizeof(data)
+    else:
+        return data, sys.getsizeof(data)
+
+def thaw(data):
+    """
+    Return a copy of data where lists and dictionaries, frozen or not,
+    are replaced by mutable copies. Other values are shared.
+    """
+    if isinstance(data, list):
+        return [thaw(x) for x in data]
+    elif isinstance(data, dict):
+        return {k: thaw(v) for k, v in data.items()}
+    else:
+        return data
+
+
+def local_path(url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'file':
+        return os.path.abspath(urllib_request.url2pathname(parts.path))
+    else:
+        return None
+
+
+class DataCache:
+    """
+    Process-wide cache of loaded data files, shared by all engines.
+
+    Entries are keyed on the absolute path of the file, its
+    modification time and its size, so that a modified file is
+    reloaded. Cached values are frozen (see freeze) so that a document
+    cannot modify the data seen by the next. When the estimated size
+    of the entries exceeds budget bytes, the least recently used ones
+    are evicted. A budget of 0 disables the cache, in which case data
+    is loaded anew every time and is not frozen.
+
+    Only local files are cached. The budget of data_cache is set in
+    megabytes by QUAINT_DATA_CACHE, 64 by default.
+    """
+
+    def __init__(self, budget = 64 * 2**20):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.latest = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def key(self, url, type):
+        path = local_path(url)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (path, type, stat.st_mtime_ns, stat.st_size)
+
+    def contains(self, url, type):
+        key = self.budget and self.key(url, type)
+        return bool(key) and key in self.entries
+
+    def load(self, url, type, compute):
+        if not self.budget:
+            return compute()
+
+        key = self.key(url, type)
+        if key is None:
+            return compute()
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+
+        value, size = freeze(compute())
+
+        with self.lock:
+            # Drop the entry for a previous version of the file
+            self.discard(self.latest.pop(key[:2], None))
+            self.discard(key)
+            if size <= self.budget:
+                self.entries[key] = (value, size)
+                self.latest[key[:2]] = key
+                self.size += size
+                self.evict()
+        return value
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def evict(self):
+        while self.size > self.budget and self.entries:
+            key, (_, size) = self.entries.popitem(last = False)
+            if self.latest.get(key[:2]) == key:
+                del self.latest[key[:2]]
+            self.size -= size
+
+    def configure(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.latest.clear()
+            self.size = 0
+
+
+def default_budget():
+    try:
+        return int(float(os.environ['QUAINT_DATA_CACHE']) * 2**20)
+    except (KeyError, ValueError):
+        return 64 * 2**20
+
+data_cache = DataCache(default_budget())
+
+
+def file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class IncludeCycle(Exception):
+    pass
+
+
+class IncludeCache:
+    """
+    Parsed trees of included files, shared by all engines, and the
+    graph of which file includes which.
+
+    A file is parsed once for each version of it (modification time
+    and size), however many documents include it. includes maps each
+    file to the set of files it included or loaded data from, so that
+    dependents(path) gives every file that must be rebuilt when path
+    changes. The edges recorded for a version of a file are dropped
+    when an edge is added for a newer version.
+    """
+
+    def __init__(self):
+        self.trees = {}
+        self.includes = {}
+        self.lock = threading.Lock()
+
+    def parse(self, path, parse):
+        path = os.path.abspath(path)
+        version = file_version(path)
+        with self.lock:
+            entry = self.trees.get(path)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        with open(path) as f:
+            tree = parse(f.read())
+        with self.lock:
+            self.trees[path] = (version, tree)
+        return tree
+
+    def add_edge(self, source, target):
+        source = os.path.abspath(source)
+        version = file_version(source)
+        with self.lock:
+            entry = self.includes.get(source)
+            if entry is None or entry[0] != version:
+                # The source changed since its edges were recorded
+                entry = self.includes[source] = (version, set())
+            entry[1].add(os.path.abspath(target))
+
+    def forget(self, source):
+        """
+        Forget the edges out of source, before it is rebuilt.
+        """
+        with self.lock:
+            self.includes.pop(os.path.abspath(source), None)
+
+    def dependencies(self):
+        """
+        Return the set of files that some file included.
+        """
+        with self.lock:
+            return set().union(*[targets for _, targets in self.includes.values()])
+
+    def dependents(self, path):
+        """
+        Return the set of files that include path, directly or not.
+        """
+        with self.lock:
+            reverse = {}
+            for source, (_, targets) in self.includes.items():
+                for target in targets:
+                    reverse.setdefault(target, set()).add(source)
+        results = set()
+        pending = [os.path.abspath(path)]
+        while pending:
+            for source in reverse.get(pending.pop(), ()):
+                if source not in results:
+                    results.add(source)
+                    pending.append(source)
+        return results
+
+    def clear(self):
+        with self.lock:
+            self.trees.clear()
+            self.includes.clear()
+
+
+include_cache = IncludeCache()
@@ -1,18 +1,32 @@
-
-import cgi
 import traceback
-from .util import dedent
+from .util import dedent, escape
 from .ast import source, source_nows
-from collections import defaultdict
+from collections import defaultdict, deque
+
+
+class Interrupted(Exception):
+    pass
 
 
 class TextDocument:
 
     def __init__(self):
-        self.data = ""
+        self.parts = []
+
+    @property
+    def data(self):
+        # Chunks are joined lazily: repeatedly concatenating onto a
+        # string attribute copies the whole document on every add.
+        if len(self.parts) != 1:
+            self.parts = ["".join(self.parts)]
+        return self.parts[0]
+
+    @data.setter
+    def data(self, data):
+        self.parts = [data]
 
     def add(self, data):
-        self.data += data
+        self.parts.append(data)
 
     def clone(self):
         rval = self.__class__()
@@ -116,11 +130,11 @@ class ErrorsDocument(ListDocument):
                     </div>
                     <div class="err_traceback">{tb}</div>
                   </div>
-                  """).format(errsource = cgi.escape(errsource),
-                              loc = cgi.escape(str(culprit.location)),
-                              error = cgi.escape(str(error)),
-                              etype = cgi.escape(etype.__name__),
-                              tb = cgi.escape("".join(tb)),
+                  """).format(errsource = escape(errsource),
+                              loc = escape(str(culprit.location)),
+                              error = escape(str(error)),
+                              etype = escape(etype.__name__),
+                              tb = escape("".join(tb)),
                               i = i + 1)
             errtext = '<div class="err_reports">%s</div>' % errtext
         else:
@@ -180,14 +194,22 @@ def complete_documents(docs, *names, **others):
 
 
 
-def prepare_documents(root, initial_documents):
-    documents = set()
+def prepare_documents(root, initial_documents, docmaps = None, targets = None):
+    # Used as an ordered set, so that documents that do not depend on
+    # each other are generated in the order they appear in
+    documents = {}
     deps = defaultdict(set)
     generators = defaultdict(list)
 
-    for docmap, node, node_deps, node_generators in root.docmaps(initial_documents):
-        for name, doc in docmap.items():
-            documents.add(doc)
+    if docmaps is None:
+        docmaps = root.docmaps(initial_documents)
+
+    seen = set()
+    for docmap, node, node_deps, node_generators in docmaps:
+        # Most nodes share the docmap of their parent
+        if id(docmap) not in seen:
+            seen.add(id(docmap))
+            documents.update(dict.fromkeys(docmap.values()))
         for name, depends_on in node_deps.items():
             if name not in docmap:
                 continue
@@ -201,15 +223,61 @@ def prepare_documents(root, initial_documents):
     for doc in documents:
         deps.setdefault(doc, set())
 
+    if targets is not None:
+        # Only the targets and the documents they depend on, directly
+        # or not, are generated
+        needed = set()
+        pending = list(targets)
+        while pending:
+            doc = pending.pop()
+            if doc not in needed:
+                needed.add(doc)
+                pending.extend(deps[doc])
+        deps = {doc: pred for doc, pred in deps.items() if doc in needed}
+
     order = toposort(deps)
     return [(doc, generators[doc]) for doc in order]
 
 
-def execute_documents(root, initial_documents):
-    documents = prepare_documents(root, initial_documents)
+def execute_documents(root, initial_documents, targets = None, interrupt = None):
+    """
+    Run the generators of root to fill in initial_documents. If
+    targets is given, it is a list of names of initial documents, and
+    only these documents (and the ones they depend on) are generated.
+    If interrupt (a threading.Event) is set while the generators run,
+    Interrupted is raised.
+    """
+    docmaps = root.docmaps(initial_documents)
+    if targets is not None:
+        targets = {initial_documents[name] for name in targets}
+
+    def run(generator, docmap):
+        if interrupt is not None and interrupt.is_set():
+            raise Interrupted()
+        generator(docmap)
+
+    if not any(node_deps for _, _, node_deps, _ in docmaps):
+        # Nothing waits on another document, so generators can run in
+        # depth-first order, which is the order they have within each
+        # document anyway. The documents are returned in the same
+        # order as prepare_documents would put them in.
+        documents = {}
+        seen = set()
+        for docmap, node, node_deps, node_generators in docmaps:
+            if id(docmap) not in seen:
+                seen.add(id(docmap))
+                documents.update(dict.fromkeys(
+                    doc for doc in docmap.values()
+                    if targets is None or doc in targets))
+            for name, gen_fn in node_generators.items():
+                if name in docmap and (targets is None or docmap[name] in targets):
+                    run(gen_fn, docmap)
+        return list(documents)
+
+    documents = prepare_documents(root, initial_documents, docmaps, targets)
     for doc, generators in documents:
         for generator, docmap in generators:
-            generator(docmap)
+            run(generator, docmap)
     return [d for d, _ in documents]
 
 
@@ -220,7 +288,7 @@ def toposort(pred):
     # element -> successors.
     pred = {k: set(v) for k, v in pred.items()}
     succ = defaultdict(set)
-    candidates = []
+    candidates = deque()
     for entry, prereqs in pred.items():
         if prereqs:
             for prereq in prereqs:
@@ -240,7 +308,7 @@ def toposort(pred):
             # If we get here, it means we looped through all
             # candidates without changing anything.
             raise Exception("There are cycles in the topological ordering. (0)")
-        candidate = candidates.pop(0)
+        candidate = candidates.popleft()
         candidates_set.remove(candidate)
         if candidate in done:
             continue
@@ -2,20 +2,19 @@
 import os
 import sys
 import re
-import cgi
 import weakref
+import threading
 from . import ast
 from .parser import parse, all_op, rx_choice, whitespace_re
-from .document import TextDocument, HTMLDocument, execute_documents
+from .document import TextDocument, HTMLDocument, execute_documents, Interrupted
 from .operparse import Source
+from .util import escape, LazyModule
 from collections import defaultdict
+from functools import partial, lru_cache
+from itertools import chain
 
-try:
-    import pygments
-    import pygments.lexers
-    import pygments.formatters
-except ImportError:
-    pygments = None
+pygments = LazyModule('pygments', 'pygments.lexers',
+                      'pygments.formatters', 'pygments.util')
 
 
 def create_pattern(ptree, properties):
@@ -196,12 +195,77 @@ class MetaNode:
         return self.process(engine, *self.args, **self.kwargs)
 
 
+# Parse trees of pattern strings, which can be saved to a file with
+# save_pattern_trees, and the patterns compiled from them
+pattern_trees = {}
+compiled_patterns = {}
+
+def compile_pattern(pattern):
+    rval = compiled_patterns.get(pattern)
+    if rval is None:
+        ptree = pattern_trees.get(pattern)
+        if ptree is None:
+            ptree = pattern_trees[pattern] = parse(pattern)
+        rval = compiled_patterns[pattern] = create_pattern(ptree, [])
+    return rval
+
+def pattern_fingerprint():
+    # The parse trees depend on the parser's source code
+    root = os.path.dirname(__file__)
+    stats = []
+    for name in ('parser.py', 'engine.py', 'ast.py',
+                 'operparse/parse.py', 'operparse/tokenize.py'):
+        stat = os.stat(os.path.join(root, name))
+        stats.append((name, stat.st_mtime_ns, stat.st_size))
+    return stats
+
+def load_pattern_trees(path):
+    """
+    Load the parse trees of patterns saved with save_pattern_trees.
+    Return False if the file is missing, unreadable or was saved by
+    another version of Quaint, in which case it is ignored. Only load
+    files that you trust: they are pickles.
+    """
+    import pickle
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('fingerprint') != pattern_fingerprint():
+            return False
+        trees = dict(data['trees'])
+    except Exception:
+        # Unpickling a foreign or truncated file can raise about anything
+        return False
+    for pattern, ptree in trees.items():
+        pattern_trees.setdefault(pattern, ptree)
+    return True
+
+def save_pattern_trees(path):
+    import pickle
+    temp = '%s.%s' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        with open(temp, 'wb') as f:
+            pickle.dump({'fingerprint': pattern_fingerprint(),
+                         'trees': dict(pattern_trees)}, f)
+        os.replace(temp, path)
+    except OSError:
+        # The cache is only an optimization
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+
 def make_rule(pattern):
 
     first_character = True
 
     if isinstance(pattern, str):
-        pattern = create_pattern(parse(pattern), [])
+        pattern = compile_pattern(pattern)
+        if not isinstance(pattern, (tuple, type)):
+            # Compiled patterns are shared, so each rule gets its own
+            # copy to hold first_character
+            pattern = partial(pattern)
 
     if isinstance(pattern, tuple) or isinstance(pattern, type):
         def p(ptree):
@@ -234,12 +298,17 @@ class Once:
     def __init__(self, predicate):
         self.predicate = make_rule(predicate)
         self.first_character = self.predicate.first_character
-        self.seen = weakref.WeakSet()
+        # Each thread has its own set, so that an engine can render
+        # documents in several threads
+        self.local = threading.local()
 
     def __call__(self, node):
-        if node in self.seen:
+        seen = getattr(self.local, 'seen', None)
+        if seen is None:
+            seen = self.local.seen = weakref.WeakSet()
+        if node in seen:
             return None
-        self.seen.add(node)
+        seen.add(node)
         result = self.predicate(node)
         if isinstance(result, dict):
             return result
@@ -256,23 +325,206 @@ def firstchar(ptree):
     return None
 
 
+class Environment(dict):
+    """
+    Dictionary of variables that can be cloned in constant time.
+
+    A clone starts out empty and looks up missing variables in its
+    parent. Setting or deleting a variable in the clone does not
+    affect the parent. Before the parent changes a variable, it hands
+    the old value (or its absence) to the clones that see it, so that
+    each clone keeps behaving like a copy made when it was created.
+
+    Environments can be used as globals for eval and exec. Class
+    bodies, however, only see the variables stored in the environment
+    itself: call materialize() before executing statements.
+
+    A frozen environment cannot be modified, and can be cloned from
+    several threads at once.
+
+    version is incremented whenever a variable is set or deleted, so
+    that results computed from the variables can tell when they are
+    out of date.
+    """
+
+    def __init__(self, *args, parent = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+        self.parent = parent
+        self.hidden = set()
+        self.frozen = False
+        # Clones, keyed on id since environments are not hashable
+        self.children = None
+        if parent is not None and not parent.frozen:
+            if parent.children is None:
+                parent.children = weakref.WeakValueDictionary()
+            parent.children[id(self)] = self
+
+    def __missing__(self, key):
+        if self.parent is None or key in self.hidden:
+            raise KeyError(key)
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return (dict.__contains__(self, key)
+                or (self.parent is not None
+                    and key not in self.hidden
+                    and key in self.parent))
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def preserve(self, key):
+        # key is about to change: clones that see it through this
+        # environment get their own copy of its current value
+        for child in list(self.children.values()):
+            if dict.__contains__(child, key) or key in child.hidden:
+                continue
+            if key in self:
+                dict.__setitem__(child, key, self[key])
+            else:
+                child.hidden.add(key)
+
+    def check_frozen(self):
+        if self.frozen:
+            raise TypeError("This environment is frozen. Use engine.context()"
+                            " to get an engine with a modifiable environment.")
+
+    def __setitem__(self, key, value):
+        self.check_frozen()
+        if self.children:
+            self.preserve(key)
+        self.hidden.discard(key)
+        dict.__setitem__(self, key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        self.check_frozen()
+        if key not in self:
+            raise KeyError(key)
+        if self.children:
+            self.preserve(key)
+        dict.pop(self, key, None)
+        if self.parent is not None:
+            self.hidden.add(key)
+        self.version += 1
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        elif default:
+            return default[0]
+        else:
+            raise KeyError(key)
+
+    def setdefault(self, key, default = None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def flatten(self):
+        """
+        Return a plain dictionary with all the visible variables.
+        """
+        if self.parent is None:
+            return dict(dict.items(self))
+        results = self.parent.flatten()
+        for key in self.hidden:
+            results.pop(key, None)
+        results.update(dict.items(self))
+        return results
+
+    def materialize(self):
+        """
+        Copy the variables inherited from the parent, so that this
+        environment no longer depends on it.
+        """
+        if self.parent is None:
+            return
+        for key, value in self.flatten().items():
+            if not dict.__contains__(self, key):
+                dict.__setitem__(self, key, value)
+        if self.parent.children is not None:
+            self.parent.children.pop(id(self), None)
+        self.parent = None
+        self.hidden = set()
+
+    def clone(self):
+        return Environment(parent = self)
+
+    def freeze(self):
+        self.frozen = True
+
+    def __iter__(self):
+        return iter(self.flatten())
+
+    def __len__(self):
+        return len(self.flatten())
+
+    def keys(self):
+        return self.flatten().keys()
+
+    def values(self):
+        return self.flatten().values()
+
+    def items(self):
+        return self.flatten().items()
+
+    def copy(self):
+        return self.flatten()
+
+    def __repr__(self):
+        return 'Environment(%r)' % self.flatten()
+
+
 class Engine:
 
-    def __init__(self, error_handler = None):
+    def __init__(self, error_handler = None, environment = None):
         self.ctors = defaultdict(list)
-        self.environment = {}
+        # Set when ctors is shared with a clone, see register
+        self.shared_ctors = False
+        self.frozen = False
+        # threading.Event that stops the evaluation when it is set
+        self.interrupt = None
+        self.environment = Environment() if environment is None else environment
+        # Cached expansions of variables, see lib.expand_variable
+        self.expansions = {}
+        # Compiled templates, see evaluate_template
+        self.skeletons = {}
         if error_handler is None:
             error_handler = default_error_handler
         self.error_handler = error_handler
 
-    def match(self, ptree):
+    @property
+    def environment(self):
+        return self._environment
 
-        candidates = self.ctors.get(firstchar(ptree), [])
+    @environment.setter
+    def environment(self, environment):
+        if not isinstance(environment, Environment):
+            environment = Environment(environment)
+        self._environment = environment
 
-        for c in ptree.__class__.__mro__:
-            candidates += self.ctors.get(c, [])
+    def match(self, ptree):
+
+        candidates = (self.ctors.get(firstchar(ptree), [])
+                      + [c for cls in ptree.__class__.__mro__
+                         for c in self.ctors.get(cls, [])]
+                      + self.ctors.get(True, []))
 
-        candidates += self.ctors.get(True, [])
         for pattern, f in candidates:
             args = pattern(ptree)
             if args is not None:
@@ -280,30 +532,65 @@ class Engine:
         return None
 
     def register(self, pattern, function, first_character = True):
+        if self.frozen:
+            raise TypeError("Cannot register rules in a frozen engine.")
         p = make_rule(pattern)
         if p.first_character is True:
             p.first_character = first_character
-        self.ctors[p.first_character].insert(0, (p, function))
+        if self.shared_ctors:
+            self.ctors = defaultdict(list, self.ctors)
+            self.shared_ctors = False
+        # The rule lists themselves are never modified in place, since
+        # other engines may hold them
+        self.ctors[p.first_character] = [(p, function)] + self.ctors[p.first_character]
 
     def extend_environment(self, **ext):
         self.environment.update(ext)
+        self.skeletons = {}
 
     def __setitem__(self, item, value):
         self.register(item, value)
 
     def clone(self):
-        rval = Engine(self.error_handler)
-        rval.ctors.update(self.ctors)
-        rval.environment.update(self.environment)
+        rval = Engine(self.error_handler, self.environment.clone())
+        rval.ctors = self.ctors
+        rval.shared_ctors = self.shared_ctors = True
+        rval.interrupt = self.interrupt
+        return rval
+
+    def freeze(self):
+        """
+        Prevent any further change to the rules and the environment of
+        this engine, so that several threads can render with it at
+        the same time through context().
+        """
+        self.frozen = True
+        self.shared_ctors = True
+        self.environment.freeze()
+
+    def context(self):
+        """
+        Return an engine to render one document with. It shares the
+        rules of this engine, but variables set while rendering (e.g.
+        __file__, or with <-) stay in its own environment, in which
+        the `engine variable refers to the context itself.
+        """
+        rval = self.clone()
+        if self.environment.get('engine') is self:
+            rval.environment['engine'] = rval
         return rval
 
     def execute(self, ptree):
+        if self.interrupt is not None and self.interrupt.is_set():
+            raise Interrupted()
         result = self.match(ptree)
         if result is None:
             raise Exception("Could not find a rule for:", ptree)
         f, args = result
         try:
             return f(self, ptree, **args)
+        except Interrupted:
+            raise
         except Exception:
             return self.error_handler(self, ptree, sys.exc_info())
 
@@ -318,7 +605,7 @@ class Engine:
     def curdir(self):
         f = self.environment['__file__']
         if f is None:
-            return os.curdir()
+            return os.curdir
         else:
             return os.path.dirname(f)
 
@@ -339,6 +626,9 @@ class Engine:
 
 
 
+# Names of the generate_* methods of each Generator subclass
+generator_names = {}
+
 class Generator:
 
     def docmaps(self, current):
@@ -348,11 +638,12 @@ class Generator:
         return {}
 
     def generators(self):
-        results = {}
-        for name in dir(self):
-            if name.startswith("generate_"):
-                results[name[9:]] = getattr(self, name)
-        return results
+        cls = type(self)
+        names = generator_names.get(cls)
+        if names is None:
+            names = [name for name in dir(cls) if name.startswith("generate_")]
+            generator_names[cls] = names
+        return {name[9:]: getattr(self, name) for name in names}
 
 
 class TransGen(Generator):
@@ -417,6 +708,23 @@ class Raw(Generator):
         return str(self)
 
 
+class Fragment(Generator):
+    """
+    Pre-rendered html and text of a generator that does not depend on
+    any other document.
+    """
+
+    def __init__(self, html, text):
+        self.html = html
+        self.text = text
+
+    def generate_html(self, docs):
+        docs['html'].add(self.html)
+
+    def generate_text(self, docs):
+        docs['text'].add(self.text)
+
+
 class Markup(Generator):
 
     def __init__(self, text):
@@ -448,7 +756,7 @@ class Text(Generator):
         docs['text'].add(self.text)
 
     def generate_html(self, docs):
-        docs['html'].add(cgi.escape(self.text))
+        docs['html'].add(escape(self.text))
 
     def __str__(self):
         return 'Text(%s)' % self.text
@@ -466,7 +774,7 @@ class Escaped(Generator):
         docs['text'].add(self.text)
 
     def generate_html(self, docs):
-        docs['html'].add(cgi.escape(self.text))
+        docs['html'].add(escape(self.text))
 
     def __str__(self):
         return 'Escaped(%s)' % self.text
@@ -560,11 +868,117 @@ class Section(RedirectGenerator):
 class TemplateMetaNode(MetaNode):
     def process(self, engine, template, main):
         engine.environment['__file__'] = main.location.source.url
-        template = engine(template)
+        template = evaluate_template(engine, template)
         main = engine(main)
         return Template(template, main)
 
 
+def prerender(gen):
+    """
+    Return a Fragment with the html and text output of gen, or gen
+    itself if it contributes to other documents or depends on them.
+    """
+    for _, _, deps, generators in gen.docmaps({'html': None, 'text': None}):
+        if deps or not set(generators) <= {'html', 'text'}:
+            return gen
+    html = HTMLDocument()
+    text = TextDocument()
+    execute_documents(gen, {'html': html, 'text': text}, ['html', 'text'])
+    rval = Fragment(html.format_html(), text.data)
+    if hasattr(gen, 'block'):
+        rval.block = gen.block
+    return rval
+
+def compile_skeleton(gen):
+    """
+    Return a generator with the same output as gen, made only of
+    pre-rendered Fragments and of the TransGens of gen, which are the
+    slots each document fills in (main, meta, css, ...). Return None
+    if gen contains other generators that depend on documents.
+    """
+    fragment = prerender(gen)
+    if fragment is not gen:
+        return fragment
+    if isinstance(gen, TransGen):
+        return gen
+    if not isinstance(gen, PartsGenerator) or gen.deps() or gen.generators():
+        return None
+    parts = []
+    for child in gen.parts():
+        if not isinstance(child, Generator):
+            child = Escaped(child)
+        child = compile_skeleton(child)
+        if child is None:
+            return None
+        if parts and isinstance(child, Fragment) and isinstance(parts[-1], Fragment):
+            parts[-1] = Fragment(parts[-1].html + child.html,
+                                 parts[-1].text + child.text)
+        else:
+            parts.append(child)
+    return Gen(*parts)
+
+def skeleton_binding(f):
+    """
+    Mark f as a binding {f}: x whose result only depends on the source
+    of x, which templates can use and still be compiled to a skeleton.
+    """
+    f.skeleton_binding = True
+    return f
+
+def static_template(engine, node):
+    """
+    Return whether node can be compiled to a skeleton: it must not
+    contain {...} blocks, which may depend on the document (__file__)
+    or register rules, except for skeleton bindings.
+    """
+    if ast.is_oper(node, ':') and ast.is_curly_bracket(node.args[0]):
+        name = ast.source(node.args[0].args[1]).strip()
+        return (name.isidentifier()
+                and getattr(engine.environment.get(name), 'skeleton_binding', False))
+    elif ast.is_curly_bracket(node):
+        return False
+    elif isinstance(node, ast.ASTNode):
+        return all(static_template(engine, arg) for arg in node.args)
+    else:
+        return True
+
+def evaluate_template(engine, template):
+    """
+    Equivalent to engine(template). If template is static (see
+    static_template), the result is compiled with compile_skeleton the
+    first time, and the skeleton is reused for the next documents in
+    the same directory rendered by engine (the pages of a site). The
+    variables set by the template are set again for each document.
+    """
+    # Parse trees hash by identity, and the key keeps template alive
+    key = (template, engine.curdir())
+    entry = engine.skeletons.get(key)
+    if entry is not None:
+        skeleton, assigned = entry
+        if skeleton is None:
+            return engine(template)
+        engine.environment.update(assigned)
+        return skeleton
+
+    if not static_template(engine, template):
+        engine.skeletons[key] = (None, None)
+        return engine(template)
+
+    env = engine.environment
+    before = dict(dict.items(env))
+    rval = engine(template)
+    after = dict(dict.items(env))
+    assigned = {k: v for k, v in after.items()
+                if k not in before or before[k] is not v}
+    # Deleting variables cannot be replayed
+    if before.keys() <= after.keys():
+        skeleton = compile_skeleton(rval)
+    else:
+        skeleton = None
+    engine.skeletons[key] = (skeleton, assigned)
+    return rval if skeleton is None else skeleton
+
+
 class Template(RedirectGenerator):
     def __init__(self, template, main):
         super().__init__('main', main, template)
@@ -628,11 +1042,21 @@ class AutoMerge(PartsGenerator):
 
     def __init__(self, children):
         c = children[:1]
+        owned = None
         for child in children[1:]:
-            if hasattr(c[-1], 'merge'):
-                m = c[-1].merge(child)
+            last = c[-1]
+            if last is owned:
+                # last was created by merge below, so nothing else
+                # refers to it and it can absorb child in place,
+                # instead of building a new generator every time.
+                if last.absorb(child):
+                    continue
+            elif hasattr(last, 'merge'):
+                m = last.merge(child)
                 if m:
                     c[-1] = m
+                    if hasattr(m, 'absorb'):
+                        owned = m
                     continue
             c.append(child)
         self.children = c
@@ -676,7 +1100,7 @@ class List(PartsGenerator):
                 start += ord(c) - displace + 1
 
         self.ordered = (o, type, start)
-        self.children = children
+        self.children = list(children)
 
     def parts(self):
         o, type, start = self.ordered
@@ -684,7 +1108,7 @@ class List(PartsGenerator):
             if type is None: type = "1"
             if start is None: start = 1
             otag = '<ol type="{type}" start="{start}">'.format(
-                type = cgi.escape(type, True),
+                type = escape(type, True),
                 start = int(start))
             ctag = '</ol>'
         else:
@@ -698,27 +1122,42 @@ class List(PartsGenerator):
             yield Markup("</li>")
         yield Markup(ctag)
 
+    def merged_ordering(self, other):
+        if not isinstance(other, List):
+            return None
+        o1, type1, start1 = self.ordered
+        o2, type2, start2 = other.ordered
+        if (o1 != o2 or
+            not (type1 is None or type2 is None or type1 == type2) or
+            not (start1 is None or start2 is None or
+                 start1 + len(self.children) == start2)):
+            return None
+        if start1 is None and start2 is not None:
+            start1 = start2 - len(self.children)
+        return (o1, type1 or type2, start1)
+
     def merge(self, other):
-        if isinstance(other, List):
-            o1, type1, start1 = self.ordered
-            o2, type2, start2 = other.ordered
-            if (o1 != o2 or
-                not (type1 is None or type2 is None or type1 == type2) or
-                not (start1 is None or start2 is None or
-                     start1 + len(self.children) == start2)):
-                return None
-            if start1 is None and start2 is not None:
-                start1 = start2 - len(self.children)
-            return List(*(self.children + other.children),
-                         ordered = (o1, type1 or type2, start1))
-        else:
+        ordered = self.merged_ordering(other)
+        if ordered is None:
             return None
+        return List(*(self.children + other.children),
+                    ordered = ordered)
+
+    def absorb(self, other):
+        # Like merge, but extends this list in place. Only valid on a
+        # List that nothing else refers to (see AutoMerge).
+        ordered = self.merged_ordering(other)
+        if ordered is None:
+            return False
+        self.ordered = ordered
+        self.children.extend(other.children)
+        return True
 
 
 class Definitions(PartsGenerator):
 
     def __init__(self, *children):
-        self.children = children
+        self.children = list(children)
 
     def parts(self):
         yield Markup("<dl>")
@@ -737,6 +1176,13 @@ class Definitions(PartsGenerator):
         else:
             return None
 
+    def absorb(self, other):
+        if isinstance(other, Definitions):
+            self.children.extend(other.children)
+            return True
+        else:
+            return False
+
 
 class TableHeader:
     def __init__(self, *cells):
@@ -748,7 +1194,7 @@ class TableHeader:
 class Table(PartsGenerator):
 
     def __init__(self, *children):
-        self.children = children
+        self.children = list(children)
 
     def parts(self):
         yield Markup("<table>")
@@ -772,6 +1218,63 @@ class Table(PartsGenerator):
         else:
             return None
 
+    def absorb(self, other):
+        if isinstance(other, Table):
+            self.children.extend(other.children)
+            return True
+        else:
+            return False
+
+
+class DataTable(Generator):
+    """
+    Render a whole dataset as a table in a single pass, producing one
+    string instead of several generators per cell. The cells are
+    plain values, which are escaped. rows may be any iterable. It is
+    iterated over each time the table is generated, except for
+    iterators, which are turned into a list the first time.
+
+    * If the rows are dictionaries, columns lists the keys to show
+      (default: the keys of the first dictionary row).
+    * header is a list of column titles (default: columns), or True
+      to use the first row as the header.
+    """
+
+    def __init__(self, rows, columns = None, header = None):
+        self.rows = rows
+        self.columns = columns
+        self.header = header
+
+    def generate_html(self, docs):
+        if iter(self.rows) is self.rows:
+            self.rows = list(self.rows)
+        rows = iter(self.rows)
+        columns = self.columns
+        header = self.header
+        if header is True:
+            header = next(rows, None)
+        first = next(rows, None)
+        if first is not None:
+            if columns is None and isinstance(first, dict):
+                columns = list(first)
+            rows = chain([first], rows)
+        if header is None:
+            header = columns
+
+        parts = ["<table>"]
+        if header is not None:
+            parts.append("<tr><th>%s</th></tr>"
+                         % "</th><th>".join(escape(str(cell)) for cell in header))
+        for row in rows:
+            if isinstance(row, dict):
+                if columns is None:
+                    columns = list(row)
+                row = [row.get(column, "") for column in columns]
+            parts.append("<tr><td>%s</td></tr>"
+                         % "</td><td>".join(escape(str(cell)) for cell in row))
+        parts.append("</table>")
+        docs['html'].add("".join(parts))
+
 
 class Paragraph(WrapGenerator):
 
@@ -795,9 +1298,23 @@ class Paragraph(WrapGenerator):
         else:
             return None
 
+    def absorb(self, other):
+        if self.can_merge and isinstance(other, Paragraph):
+            if self.prefix is None:
+                # Empty so far, so the markup has yet to be set up
+                self.__init__(self.children + other.children, True)
+            else:
+                self.children.extend(other.children)
+            return True
+        else:
+            return False
+
+@lru_cache(maxsize = 1024)
 def codehl(lang, code):
+    # Highlighting is slow, and the same snippets tend to come back
+    # (e.g. shown and run, or rebuilt in watch mode)
     if not pygments:
-        return cgi.escape(code)
+        return escape(code)
     if lang == 'auto':
         lexer = pygments.lexers.guess_lexer(code)
     else:
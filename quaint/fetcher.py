@@ -0,0 +1,212 @@
+
+import os
+import json
+import hashlib
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+
+redirect_codes = (301, 302, 303, 307, 308)
+user_agent = 'quaint/0.1'
+
+
+class Fetcher:
+    """
+    Fetch the contents of URLs for urlload.
+
+    * HTTP(S) connections are kept alive and reused, with at most
+      max_connections simultaneous requests per host.
+    * If cache_dir is not None, responses that carry an ETag or a
+      Last-Modified header are stored there, and later fetches of the
+      same URL send a conditional request: a 304 response is answered
+      from the cache. Storing is best-effort: if the entry cannot be
+      written, the response is used all the same.
+    * timeout (in seconds) applies to connecting and to each read.
+
+    Other URL schemes (e.g. file:), and URLs that must go through a
+    proxy (see HTTP_PROXY, HTTPS_PROXY and NO_PROXY), go through
+    urllib.
+    """
+
+    def __init__(self, timeout = 30, cache_dir = None, max_connections = 4):
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.max_connections = max_connections
+        self.idle = defaultdict(list)
+        self.slots = {}
+        self.lock = threading.Lock()
+        self.proxies = urllib.request.getproxies()
+        # urlopen would keep using the proxies it found on its first call
+        self.opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler(self.proxies))
+
+    def fetch(self, url):
+        return self.fetch_bytes(url).decode('utf-8')
+
+    def fetch_bytes(self, url, redirects = 5):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            request = urllib.request.Request(url, headers = {'User-Agent': user_agent})
+            with self.opener.open(request, timeout = self.timeout) as f:
+                return f.read()
+
+        cached = self.cache_get(url)
+        headers = {'User-Agent': user_agent}
+        if cached is not None:
+            meta, _ = cached
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        if self.proxied(parts):
+            status, reason, rheaders, body = self.request_proxied(url, headers)
+        else:
+            status, reason, rheaders, body = self.request(parts, headers)
+
+        if status == 304 and cached is not None:
+            return cached[1]
+        elif status in redirect_codes and rheaders.get('Location') and redirects:
+            return self.fetch_bytes(urllib.parse.urljoin(url, rheaders['Location']),
+                                    redirects - 1)
+        elif status != 200:
+            raise urllib.error.HTTPError(url, status, reason, rheaders, None)
+
+        self.cache_put(url, rheaders, body)
+        return body
+
+    def proxied(self, parts):
+        return (parts.scheme in self.proxies
+                and not urllib.request.proxy_bypass(parts.netloc.rpartition('@')[2]))
+
+    def request_proxied(self, url, headers):
+        # urllib knows how to talk to proxies, but does not reuse
+        # connections. It follows redirects itself.
+        request = urllib.request.Request(url, headers = headers)
+        try:
+            with self.opener.open(request, timeout = self.timeout) as f:
+                return f.status, f.reason, f.headers, f.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return e.code, e.reason, e.headers, b""
+            raise
+
+    def request(self, parts, headers):
+        host = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers, Host = parts.netloc.rpartition('@')[2])
+
+        with self.slot(host):
+            while True:
+                conn, reused = self.connection(host)
+                try:
+                    conn.request('GET', path, headers = headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError):
+                    conn.close()
+                    if reused:
+                        # The server may have closed an idle
+                        # connection: try again on a new one.
+                        continue
+                    raise
+                if response.will_close:
+                    conn.close()
+                else:
+                    with self.lock:
+                        self.idle[host].append(conn)
+                return response.status, response.reason, response.headers, body
+
+    def slot(self, host):
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.max_connections)
+            return self.slots[host]
+
+    def connection(self, host):
+        with self.lock:
+            if self.idle[host]:
+                return self.idle[host].pop(), True
+        scheme, hostname, port = host
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(hostname, port, timeout = self.timeout)
+        else:
+            conn = http.client.HTTPConnection(hostname, port, timeout = self.timeout)
+        return conn, False
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+    def cache_path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name)
+
+    def cache_get(self, url):
+        # An entry is a line of JSON metadata followed by the body
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.cache_path(url), 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return meta, body
+
+    def cache_put(self, url, headers, body):
+        if self.cache_dir is None:
+            return
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not (etag or last_modified) or 'no-store' in headers.get('Cache-Control', ''):
+            return
+        meta = json.dumps({'url': url, 'etag': etag, 'last_modified': last_modified})
+        path = self.cache_path(url)
+        # Write to a temporary file and rename it, so that concurrent
+        # builds never read a partial entry.
+        temp = '%s.%s.%s' % (path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            with open(temp, 'wb') as f:
+                f.write(meta.encode('utf-8') + b"\n")
+                f.write(body)
+            os.replace(temp, path)
+        except OSError:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+
+
+def default_cache_dir():
+    # The cache is opt-in: QUAINT_HTTP_CACHE names its directory
+    return os.environ.get('QUAINT_HTTP_CACHE') or None
+
+
+__fetcher = None
+
+def get_fetcher():
+    global __fetcher
+    if __fetcher is None:
+        __fetcher = Fetcher(cache_dir = default_cache_dir())
+    return __fetcher
+
+def set_fetcher(fetcher):
+    """
+    Replace the fetcher used by urlload. It can be any object with a
+    fetch(url) method returning a string.
+    """
+    global __fetcher
+    __fetcher = fetcher
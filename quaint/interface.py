@@ -1,10 +1,12 @@
 
 import os
+import threading
 from .parser import parse
+from .operparse import Source
 from .builders import (
     AddDocumentsMetaNode,
-    HTMLMetaNode, MultiMetaNode,
-    default_engine
+    HTMLMetaNode, MultiMetaNode, PrefetchMetaNode,
+    default_engine, q_engine
     )
 from .document import (
     make_documents, execute_documents
@@ -12,26 +14,27 @@ from .document import (
 from .engine import (
     TemplateMetaNode, HTMLDocument
     )
-from . import ast, extensions, builders, engine as mod_engine
+from . import ast, lib, extensions, builders, engine as mod_engine
 
 
-def evaluate(x, engine, documents):
-    execute_documents(engine(x), documents)
+def evaluate(x, engine, documents, targets = None):
+    execute_documents(engine(x), documents, targets, engine.interrupt)
 
 
-__fullhtml_template_text = open(os.path.join(os.path.dirname(__file__),
-                                             'default_template.q')).read()
-
 __fullhtml_template = None
 
 
 def fullhtml_template():
     global __fullhtml_template
     if __fullhtml_template is None:
-        __fullhtml_template = parse(__fullhtml_template_text)
+        path = os.path.join(os.path.dirname(__file__), 'default_template.q')
+        with open(path) as f:
+            __fullhtml_template = parse(f.read())
     return __fullhtml_template
 
 
+__extensions = {}
+
 def get_extension(ext):
 
     if isinstance(ext, tuple):
@@ -40,6 +43,14 @@ def get_extension(ext):
     if not isinstance(ext, str):
         return (ext, None)
 
+    # Failed imports are slow, so each name is only resolved once
+    if ext not in __extensions:
+        __extensions[ext] = find_extension(ext)
+    return __extensions[ext]
+
+
+def find_extension(ext):
+
     try:
         pack = __import__(ext, fromlist = ["the interface to __import__ is weird"])
         return (getattr(pack, 'quaint_extend'), None)
@@ -81,7 +92,8 @@ def make_source(source):
     return ptree
 
 def make_engine(engine, extensions):
-    engine = engine or default_engine()
+    # A given engine is not modified, so that it can be reused
+    engine = engine.context() if engine else default_engine()
     apply_extensions(engine, extensions)
     return engine
 
@@ -94,17 +106,202 @@ def full_html(source, extensions = [], engine = None, template = None):
     return files['result'].data
 
 
-def site(sources, extensions = [], engine = None):
+def site_node(sources):
     nodes = []
     for name, source, template in sources:
         ptree = make_source(source)
         tptree = make_source(template or fullhtml_template())
-        node = AddDocumentsMetaNode(HTMLMetaNode(TemplateMetaNode(tptree, ptree)),
-                                    *htdocs)
+        node = AddDocumentsMetaNode(
+            PrefetchMetaNode(HTMLMetaNode(TemplateMetaNode(tptree, ptree)),
+                             ptree, tptree),
+            *htdocs)
         nodes.append((name, node))
-    documents = make_documents('files', 'globalinfo')
-    node = MultiMetaNode(('meta', 'sections'), nodes)
+    return MultiMetaNode(('meta', 'sections'), nodes)
 
-    evaluate(node, make_engine(engine, extensions), documents)
+def site(sources, extensions = [], engine = None):
+    documents = make_documents('files', 'globalinfo')
+    evaluate(site_node(sources), make_engine(engine, extensions), documents)
     return documents['files'].data
 
+def reads_document(gen, documents, name):
+    """
+    Whether a generator of gen needs documents[name] to be generated
+    before it, e.g. because it was made by genfrom(name).
+    """
+    doc = documents[name]
+    for docmap, _, node_deps, _ in gen.docmaps(documents):
+        for sources in node_deps.values():
+            if isinstance(sources, str):
+                sources = (sources,)
+            if any(docmap.get(src) is doc for src in sources):
+                return True
+    return False
+
+def site_stream(names, load, extensions = [], engine = None,
+                globalinfo = None, readers = None):
+    """
+    Like site, but render the pages one at a time, so that memory use
+    does not grow with their number. load(name) must return (source,
+    template) for the page name; it is called again for each pass.
+
+    Yields (path, document) for each page, as soon as it is rendered.
+
+    The globalinfo document holds the meta and sections of every page.
+    It is made by a first pass that evaluates every page and generates
+    only these documents. If globalinfo is None, that pass runs when
+    the first page that reads globalinfo is about to be generated; if
+    it is true, it runs before any page is rendered, and if it is
+    false, it is skipped. If readers is a set, the names of the pages
+    that read globalinfo are added to it.
+    """
+    info = make_documents('globalinfo')['globalinfo']
+
+    def gather():
+        eng = make_engine(engine, extensions)
+        for name in names:
+            source, template = load(name)
+            documents = make_documents('files', 'globalinfo')
+            evaluate(site_node([(name, source, template)]), eng, documents,
+                     ['globalinfo'])
+            info.data.update(documents['globalinfo'].data)
+
+    if globalinfo:
+        gather()
+
+    eng = make_engine(engine, extensions)
+    for name in names:
+        source, template = load(name)
+        # The entry of the page in globalinfo is generated again
+        documents = make_documents('files', globalinfo = info)
+        gen = eng(site_node([(name, source, template)]))
+        if ((globalinfo is None or readers is not None)
+                and reads_document(gen, documents, 'globalinfo')):
+            if readers is not None:
+                readers.add(name)
+            if globalinfo is None:
+                gather()
+                globalinfo = True
+        execute_documents(gen, documents, None, eng.interrupt)
+        yield from documents['files'].data.items()
+
+
+
+def prefetch_sources(engine, pages):
+    # Start fetching the data loaded by every page, relative to each
+    # page's own path
+    pending = {}
+    for name, ptree, tptree in pages:
+        page = engine.clone()
+        page.environment['__file__'] = ptree.location.source.url
+        page.environment['__prefetched__'] = pending
+        lib.prefetch(page, ptree, tptree)
+    return pending
+
+async def site_async(sources, extensions = [], engine = None,
+                     executor = None, timeout = None):
+    """
+    Like site, but without blocking the event loop. Parsing and
+    rendering run in executor (a concurrent.futures executor, by
+    default the loop's). Data loaded with `<= from URLs is downloaded
+    concurrently before rendering starts, while the event loop waits.
+
+    The render is interrupted if it is cancelled or if it takes more
+    than timeout seconds, in which case asyncio.TimeoutError is
+    raised.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    interrupt = threading.Event()
+
+    def run(f, *args):
+        return loop.run_in_executor(executor, f, *args)
+
+    def parse_sources():
+        return [(name, make_source(source), make_source(template or fullhtml_template()))
+                for name, source, template in sources]
+
+    async def render():
+        eng = await run(make_engine, engine, extensions)
+        eng.interrupt = interrupt
+        pages = await run(parse_sources)
+        pending = await run(prefetch_sources, eng, pages)
+        if pending:
+            await asyncio.wait([asyncio.wrap_future(f) for f in pending.values()])
+        eng.environment['__prefetched__'] = pending
+        documents = make_documents('files', 'globalinfo')
+        await run(evaluate, site_node(pages), eng, documents)
+        return documents['files'].data
+
+    try:
+        return await asyncio.wait_for(render(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # Stops the render thread if it is still running
+        interrupt.set()
+        raise
+
+async def full_html_async(source, extensions = [], engine = None, template = None,
+                          executor = None, timeout = None):
+    files = await site_async([('result', source, template)], extensions, engine,
+                             executor, timeout)
+    return files['result'].data
+
+
+
+__batch_extensions = []
+__batch_engines = {}
+
+def batch_setup(extensions):
+    global __batch_extensions
+    __batch_extensions = extensions
+    __batch_engines.clear()
+
+def batch_engine(path):
+    # .py.q files are rendered with the default engine, other files
+    # with q_engine, like `quaint html` does
+    kind = path.endswith('.py.q')
+    if kind not in __batch_engines:
+        engine = default_engine() if kind else q_engine()
+        apply_extensions(engine, __batch_extensions)
+        engine.freeze()
+        __batch_engines[kind] = engine
+    return __batch_engines[kind]
+
+def batch_render(job):
+    path, dest = job
+    try:
+        with open(path) as f:
+            s = f.read()
+        html = full_html(Source(s, url = path), engine = batch_engine(path))
+        dest_dir = os.path.dirname(dest)
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok = True)
+        with open(dest, "w") as f:
+            print(html, file = f)
+    except Exception as e:
+        # Exceptions may not survive the trip back from a worker process
+        return path, "%s: %s" % (type(e).__name__, e)
+    return path, None
+
+def html_files(jobs, extensions = [], processes = 1):
+    """
+    Render each (path, dest) pair of jobs: the source file at path
+    becomes a full HTML page written to dest. Every page is rendered
+    on its own, without the cross-page information of site, by an
+    engine that is built once and reused for all of them. If
+    processes > 1, the pages are divided between as many worker
+    processes.
+
+    Yields (path, error) as each page is done, where error is None on
+    success and a description of the failure otherwise.
+    """
+    jobs = list(jobs)
+    if processes <= 1 or len(jobs) <= 1:
+        batch_setup(extensions)
+        for job in jobs:
+            yield batch_render(job)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(jobs) // (processes * 4))
+        with ProcessPoolExecutor(processes, initializer = batch_setup,
+                                 initargs = (extensions,)) as executor:
+            yield from executor.map(batch_render, jobs, chunksize = chunksize)
@@ -1,16 +1,21 @@
 
 import os
-import cgi
-import urllib.request
+import re
+import mmap
+import urllib.parse
 import inspect
+from functools import lru_cache
 from . import ast, parser, engine as mod_engine
 from .parser import parse
+from .cache import data_cache, include_cache, local_path, thaw, IncludeCycle
 from .document import (
     HTMLDocument, TextDocument, execute_documents
     )
 from .util import (
     format_anchor,
     dedent,
+    escape,
+    LazyModule,
     )
 from .ast import (
     collapse,
@@ -24,21 +29,22 @@ from .engine import (
     Generator,
     Raw, Text, Escaped, Markup,
     TransGen, GenFor, GenFrom,
-    List, Definitions, Table, TableHeader,
+    List, Definitions, Table, TableHeader, DataTable,
     Gen,
     Section,
     Paragraph,
     AutoMerge,
     TOCGenerator,
+    Fragment,
+    prerender,
+    skeleton_binding,
     )
 pyeval = eval
 
-import csv
 import json as pyjson
-try:
-    import yaml as pyyaml
-except ImportError:
-    pyyaml = None
+csv = LazyModule('csv')
+pyyaml = LazyModule('yaml')
+urllib_request = LazyModule('urllib.request')
 
 
 def wrap_whitespace(f):
@@ -77,7 +83,7 @@ def make_tags(tag, attributes, engine, args):
         if value:
             if value.startswith('"') and value.endswith('"'):
                 value = value[1:-1]
-            opening_tag += ' %s="%s"' % (attr, cgi.escape(value, True))
+            opening_tag += ' %s="%s"' % (attr, escape(value, True))
     opening_tag += ">"
     return Markup(opening_tag), Markup("</%s>" % tag)
 
@@ -318,11 +324,14 @@ def link(engine, node, text, link = None):
 @wrap_whitespace
 def elink(engine, node, text, link = None):
     if link is None or isinstance(link, ast.Void):
-        link = text
+        link = text = engine(text)
+    else:
+        link = engine(link)
+        text = engine(text)
     return Gen(Markup('<a href="'),
-               parse_link(format_text(engine, link)),
+               parse_link(format_targets(link, 'text')[0]),
                Markup('">'),
-               engine(text),
+               text,
                Markup('</a>'))
 
 @wrap_whitespace
@@ -436,13 +445,15 @@ def header_n(n):
     def header(engine, node, title = None):
         if title is None:
             title, _ = node.args
-        anchor = format_anchor(format_text(engine, title).strip())
+        title = engine(title)
+        text, html = format_targets(title, 'text', 'html')
+        anchor = format_anchor(text.strip())
         return Gen(GenFor('links', anchor, '#'+anchor),
-                   GenFor('sections', anchor, format_html(engine, title), n),
+                   GenFor('sections', anchor, html, n),
                    Markup('<h%s id="' % n),
                    Markup(anchor),
                    Markup('">'),
-                   engine(title),
+                   title,
                    Markup("</h%s>" % n))
     return header
 
@@ -457,7 +468,7 @@ toc = TOCGenerator()
 
 
 def table_row(engine, node, row):
-    return Table(map(engine, collapse(row, '|')))
+    return Table(list(map(engine, collapse(row, '|'))))
 
 def table_header(engine, node, row):
     return Table(TableHeader(*map(engine, collapse(row, '+'))))
@@ -476,12 +487,42 @@ def dlist(engine, node, term, definition):
     return Definitions((engine(term), engine(definition)))
 
 
+def expand_variable(engine, name, body):
+    """
+    Equivalent to engine(body), where body is the value of the
+    variable name. The result is reused as long as no variable is set
+    (see Environment.version), unless body contains {...} blocks,
+    which may give something different every time. From the second
+    use on, it is pre-rendered if possible.
+    """
+    env = engine.environment
+    entry = engine.expansions.get(name)
+    if (entry is not None and entry[0] is body
+            and entry[1] is env and entry[2] == env.version):
+        if entry[4] is None:
+            # Generators that merge with their neighbours (list items,
+            # paragraphs, ...) must stay as they are
+            entry[4] = entry[3] if hasattr(entry[3], 'merge') else prerender(entry[3])
+        return entry[4]
+    version = env.version
+    result = engine(body)
+    if env.version == version and not has_evals(body):
+        # Evaluating body did not set any variable
+        engine.expansions[name] = [body, env, version, result, None]
+    return result
+
+def has_evals(node):
+    if ast.is_curly_bracket(node):
+        return True
+    return isinstance(node, ast.ASTNode) and any(has_evals(arg) for arg in node.args)
+
+
 @wrap_whitespace
 def safe_eval(engine, node, body):
     var = source_nows(body)
     x = engine.environment[var]
     if isinstance(x, (ast.ASTNode, ast.quaintstr)):
-        x = engine(x)
+        x = expand_variable(engine, var, x)
     elif not isinstance(x, Generator):
         x = Escaped(str(x))
     return x
@@ -493,19 +534,39 @@ def safe_feval(engine, node, f, x):
     return f(engine, node, x)
 
 
+@lru_cache(maxsize = 4096)
+def compile_snippet(code):
+    """
+    Dedent and compile the Python source code of an eval block and
+    return (code_object, is_expression). A block that is not an
+    expression is compiled as a sequence of statements.
+    """
+    code = dedent(code)
+    try:
+        return compile(code, '<string>', 'eval'), True
+    except SyntaxError:
+        return compile(code, '<string>', 'exec'), False
+
 @wrap_whitespace
 def eval(engine, node, body):
 
-    code = dedent(source(body))
+    text = source(body)
+    code, is_expression = compile_snippet(text)
 
-    try:
-        x = pyeval(code, engine.environment)
-    except SyntaxError:
+    if not is_expression:
+        # Class bodies do not look up variables in the parents of a
+        # cloned environment
+        engine.environment.materialize()
         exec(code, engine.environment)
         x = Raw("")
     else:
+        x = pyeval(code, engine.environment)
         if isinstance(x, (ast.ASTNode, ast.quaintstr)):
-            x = engine(x)
+            name = text.strip()
+            if name.isidentifier():
+                x = expand_variable(engine, name, x)
+            else:
+                x = engine(x)
         elif x in (False, None):
             x = Text("")
         elif not isinstance(x, Generator):
@@ -516,7 +577,10 @@ def eval(engine, node, body):
 
 @wrap_whitespace
 def feval(engine, node, f, x):
-    code = dedent(source(f))
+    code, is_expression = compile_snippet(source(f))
+    if not is_expression:
+        # Raise the SyntaxError
+        compile(dedent(source(f)), '<string>', 'eval')
     f = pyeval(code, engine.environment)
     return f(engine, node, x)
 
@@ -577,12 +641,15 @@ def domnode(engine, node, tag, body):
 
 
 
+@skeleton_binding
 def css(engine, node, x):
     return GenFor('css', x.raw())
 
+@skeleton_binding
 def js(engine, node, x):
     return GenFor('js', x.raw())
 
+@skeleton_binding
 def html(engine, node, code):
     if ast.is_square_bracket(code):
         code = code.args[1]
@@ -596,45 +663,200 @@ def setvar(engine, node, name, body):
 
 load_handlers = {}
 
-def load_type(type):
+def load_type(type, cached = False):
+    # Handlers declared with cached = True return plain data parsed
+    # from the whole file, which can be shared through data_cache.
     def wrap(f):
+        f.cached = cached
         load_handlers[type] = f
         return f
     return wrap
 
-def urlload(url, engine):
-    if isinstance(url, ast.InlineOp) and url.operator in ['://', ':']:
-        file = source_nows(url)
+# Schemes have at least two characters here, so that Windows paths
+# like C:\data.csv are not taken for URLs
+url_scheme_re = re.compile("[a-zA-Z][a-zA-Z0-9+.-]+:")
+
+def resolve_url(url, engine):
+    url = source_nows(url)
+    if url_scheme_re.match(url):
+        return url
     else:
-        file = 'file:' + engine.expand_path(source_nows(url))
-    return urllib.request.urlopen(file).read().decode('utf-8')
+        return 'file:' + engine.expand_path(url)
+
+def fetch(url):
+    from .fetcher import get_fetcher
+    return get_fetcher().fetch(url)
+
+def urlload(url, engine):
+    file = resolve_url(url, engine)
+    pending = engine.environment.get('__prefetched__', {}).pop(file, None)
+    if pending is not None:
+        return pending.result()
+    return fetch(file)
+
+
+class URLLines:
+    """
+    Iterable over the lines of a file or URL. Nothing is read until
+    iteration starts, and the lines are read lazily (local files are
+    memory-mapped). Each iteration reads the source anew.
+    """
+
+    def __init__(self, url):
+        self.url = url
+
+    def __iter__(self):
+        parts = urllib.parse.urlsplit(self.url)
+        if parts.scheme == 'file':
+            path = urllib_request.url2pathname(parts.path)
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+                    for line in iter(m.readline, b""):
+                        yield line.decode('utf-8')
+        else:
+            with urllib_request.urlopen(self.url) as f:
+                for line in f:
+                    yield line.decode('utf-8')
+
+
+class StreamLoader:
+    """
+    Lazily parse the lines of a file or URL: iterating over a
+    StreamLoader yields the results of parse(lines), where lines
+    iterates over URLLines(url).
+    """
+
+    def __init__(self, url, parse):
+        self.url = url
+        self.parse = parse
+
+    def __iter__(self):
+        return iter(self.parse(URLLines(self.url)))
 
-@load_type('yaml')
+@load_type('yaml', cached = True)
 def load_yaml(engine, node, file):
     if not pyyaml:
         raise ImportError("yaml is not installed!")
     results = pyyaml.safe_load(urlload(file, engine))
     return results
 
-@load_type('json')
+@load_type('json', cached = True)
 def load_json(engine, node, file):
     results = pyjson.loads(urlload(file, engine))
     return results
 
-@load_type('csv')
+@load_type('csv', cached = True)
 def load_csv(engine, node, file):
     results = list(csv.reader(urlload(file, engine).split('\n'), skipinitialspace = True))
     return results
 
+@load_type('csv-stream')
+def load_csv_stream(engine, node, file):
+    return StreamLoader(resolve_url(file, engine),
+                        lambda lines: csv.reader(lines, skipinitialspace = True))
 
-def load_in_var(engine, node, name, file, type = None):
+@load_type('jsonl')
+def load_jsonl(engine, node, file):
+    return StreamLoader(resolve_url(file, engine),
+                        lambda lines: (pyjson.loads(line) for line in lines
+                                       if line.strip()))
+
+
+def get_load_type(file, type = None):
     if type is None or isinstance(type, ast.Void):
-        type = source_nows(file).split(".")[-1]
-    results = load_handlers[type](engine, node, file)
+        return source_nows(file).split(".")[-1]
+    while ast.is_square_bracket(type):
+        type = type.args[1]
+    return source_nows(type)
+
+def depend_on(engine, url):
+    # Record that the file being evaluated uses url, so that watchers
+    # know to rebuild it when url changes (see IncludeCache)
+    path = local_path(url)
+    chain = engine.environment.get('__includes__')
+    source = chain[-1] if chain else engine.environment.get('__file__')
+    if path and source:
+        include_cache.add_edge(source, path)
+
+def load_in_var(engine, node, name, file, type = None):
+    type = get_load_type(file, type)
+    handler = load_handlers[type]
+    depend_on(engine, resolve_url(file, engine))
+    if getattr(handler, 'cached', False):
+        results = data_cache.load(resolve_url(file, engine), type,
+                                  lambda: handler(engine, node, file))
+    else:
+        results = handler(engine, node, file)
     engine.environment[source_nows(name)] = results
     return Raw("")
 
 
+prefetch_workers = 8
+__prefetch_pool = None
+__load_patterns = None
+
+def prefetch_pool():
+    global __prefetch_pool
+    if __prefetch_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        __prefetch_pool = ThreadPoolExecutor(prefetch_workers)
+    return __prefetch_pool
+
+def shutdown_prefetch_pool(wait = True):
+    """
+    Stop the threads that prefetch data files. A new pool is started
+    if something is prefetched afterwards.
+    """
+    global __prefetch_pool
+    pool, __prefetch_pool = __prefetch_pool, None
+    if pool is not None:
+        pool.shutdown(wait = wait)
+
+def find_loads(ptree):
+    """
+    Yield (file, type) for every `name <= file` load in ptree. Python
+    code in {} and code blocks are not searched.
+    """
+    global __load_patterns
+    if __load_patterns is None:
+        __load_patterns = [mod_engine.make_rule('name <= [maybe type] :: file'),
+                           mod_engine.make_rule('name <= shed1 file')]
+    stack = [ptree]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, ast.Op) or ast.is_curly_bracket(node):
+            continue
+        if node.operator == '<=':
+            for pattern in __load_patterns:
+                args = pattern(node)
+                if args is not None:
+                    yield args['file'], get_load_type(args['file'],
+                                                      args.get('type'))
+                    break
+        elif node.operator not in ('%', '`'):
+            stack.extend(reversed(node.args))
+
+def prefetch(engine, *ptrees):
+    """
+    Start fetching, concurrently, the files loaded with `<=` in the
+    given parse trees, so that load_in_var finds them already
+    downloaded when the engine reaches them. Only loads that read the
+    whole file (and are not in data_cache already) are prefetched.
+    """
+    pending = engine.environment.setdefault('__prefetched__', {})
+    for ptree in ptrees:
+        for file, type in find_loads(ptree):
+            handler = load_handlers.get(type)
+            if not getattr(handler, 'cached', False):
+                continue
+            url = resolve_url(file, engine)
+            if url not in pending and not data_cache.contains(url, type):
+                pending[url] = prefetch_pool().submit(fetch, url)
+    return pending
+
+
 def import_data(engine, data):
     if not isinstance(data, dict):
         raise Exception("the data should be a dictionary")
@@ -654,10 +876,18 @@ def json(engine, node, expr):
     import_data(engine, results)
     return Raw("")
 
+__yaml_words = {'y', 'n', 'yes', 'no', 'on', 'off', 'true', 'false', 'null'}
+
+@skeleton_binding
 def meta(engine, node, defs):
-    if not pyyaml:
+    raw = defs.raw()
+    if raw.isidentifier() and raw.lower() not in __yaml_words:
+        # A plain key such as {meta}: title does not need yaml
+        results = raw
+    elif not pyyaml:
         raise ImportError("yaml is not installed!")
-    results = pyyaml.safe_load(defs.raw())
+    else:
+        results = pyyaml.safe_load(raw)
     if isinstance(results, str):
         return GenFrom('meta', lambda doc: str(doc.get(results, "") or ""))
     elif isinstance(results, dict):
@@ -666,7 +896,7 @@ def meta(engine, node, defs):
         raise Exception("Meta-information must be a dictionary", results)
 
 def ifthenelse(engine, node, cond, yes, no = None):
-    cond = format_html(engine, cond).strip()
+    cond = format_targets(engine(cond), 'html')[0].strip()
     if cond:
         return engine(yes)
     elif no:
@@ -691,9 +921,50 @@ def show_args(engine, node, **params):
                Gen(*args),
                Raw("</table>"))
 
+def data_table(engine, node, data):
+    # {data_table}: var [columns = a, b] [header = A, B]
+    options = {}
+    if ast.is_oper(data, ''):
+        data, *props = data.args
+        for prop in props:
+            extract_props(prop, options)
+    columns = options.get('columns')
+    if columns is not None:
+        columns = [column.strip() for column in columns.split(',')]
+    header = options.get('header')
+    if header == 'first':
+        header = True
+    elif header is not None:
+        header = [title.strip() for title in header.split(',')]
+    name = source_nows(data)
+    rows = engine.environment[name]
+    if iter(rows) is rows:
+        # An iterator can only be read once, so the rows are kept for
+        # the other tables of the variable
+        rows = engine.environment[name] = list(rows)
+    return DataTable(rows, columns = columns, header = header)
+
 def include(engine, node, file):
-    return engine(parse(engine.open(source_nows(file)).read()))
+    path = os.path.abspath(engine.expand_path(source_nows(file)))
+    outer = chain = engine.environment.get('__includes__')
+    if chain is None:
+        root = engine.environment.get('__file__')
+        chain = (os.path.abspath(root),) if root else ()
+    if path in chain:
+        raise IncludeCycle("Include cycle: " + " -> ".join(chain[chain.index(path):] + (path,)))
+    if chain:
+        include_cache.add_edge(chain[-1], path)
+    tree = include_cache.parse(path, parse)
+    engine.environment['__includes__'] = chain + (path,)
+    try:
+        return engine(tree)
+    finally:
+        if outer is None:
+            engine.environment.pop('__includes__', None)
+        else:
+            engine.environment['__includes__'] = outer
 
+@skeleton_binding
 def insert_document(engine, node, docname):
     def fmt(doc):
         return doc.format_html()
@@ -719,22 +990,33 @@ def genfrom(*docs):
 
 
 
+def format_targets(gen, *targets):
+    """
+    Render the generator gen to each of the given targets ('html' or
+    'text') in a single pass, and return the results in the same
+    order.
+    """
+    docs = {target: HTMLDocument() if target == 'html' else TextDocument()
+            for target in targets}
+    execute_documents(gen, docs, targets)
+    return [docs[target].data for target in targets]
+
 def format_html(engine, node = None):
     html = HTMLDocument()
     docs = {'html': html}
     if node is None:
-        execute_documents(engine, docs)
+        execute_documents(engine, docs, ['html'])
     else:
-        execute_documents(engine(node), docs)
+        execute_documents(engine(node), docs, ['html'])
     return html.format_html()
 
 def format_text(engine, node):
     text = TextDocument()
     docs = {'text': text}
     if node is None:
-        execute_documents(engine, docs)
+        execute_documents(engine, docs, ['text'])
     else:
-        execute_documents(engine(node), docs)
+        execute_documents(engine(node), docs, ['text'])
     return text.data
 
 
@@ -1,5 +1,5 @@
 
-import exc
+from .. import exc
 from bisect import bisect_right
 from functools import reduce
 
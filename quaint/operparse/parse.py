@@ -125,8 +125,21 @@ def operator_parse(tokenizer, order, finalize):
 
             elif o == 'a':
                 def new_make_left(*right, aggregate = []):
-                    return make_left(between, *right,
-                                     aggregate = [right_op] + aggregate)
+                    # Unroll the whole chain of aggregated operators
+                    # iteratively, so that long runs of them (e.g. one
+                    # line break per paragraph) do not recurse once
+                    # per operator nor copy the aggregate each time.
+                    betweens, ops = [], []
+                    f = new_make_left
+                    while hasattr(f, 'aggregated'):
+                        f, b, op = f.aggregated
+                        betweens.append(b)
+                        ops.append(op)
+                    betweens.reverse()
+                    ops.reverse()
+                    return f(*(betweens + list(right)),
+                             aggregate = ops + list(aggregate))
+                new_make_left.aggregated = (make_left, between, right_op)
                 next_id = next(tokenizer)
                 try:
                     righter_op = next(tokenizer)
@@ -0,0 +1,263 @@
+
+import os
+import sys
+import stat
+import json
+import signal
+import struct
+import socket
+import threading
+import socketserver
+from functools import lru_cache
+from .operparse import Source
+from .parser import parse
+from .builders import default_engine, q_engine, bare_engine
+from .interface import full_html, apply_extensions
+from . import lib
+
+# Every message, in both directions, is a 4-byte big-endian length
+# followed by that many bytes of UTF-8 encoded JSON.
+#
+# Request:  {"source": str, "engine": "q" | "py" | "bare", "env": {...},
+#            "extensions": [...], "template": str, "path": str}
+#           (everything but source is optional)
+# Response: {"html": str} or {"error": str, "type": str}
+#
+# Requests may only use the extensions and engine flavors the server
+# allows: the py engine runs the Python code of the source.
+
+header = struct.Struct('>I')
+max_message = 256 * 2**20
+
+engine_flavors = dict(
+    q = q_engine,
+    py = default_engine,
+    bare = bare_engine,
+    )
+
+
+class ProtocolError(Exception):
+    pass
+
+class RenderError(Exception):
+    pass
+
+
+def read_exactly(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        if data:
+            raise ProtocolError("Connection closed in the middle of a message")
+        return None
+    return data
+
+def read_message(f):
+    """
+    Read a message from the binary file f. Returns None if the
+    connection was closed before it.
+    """
+    data = read_exactly(f, header.size)
+    if data is None:
+        return None
+    size, = header.unpack(data)
+    if size > max_message:
+        raise ProtocolError("Message too long (%s bytes)" % size)
+    data = read_exactly(f, size)
+    if data is None:
+        raise ProtocolError("Connection closed in the middle of a message")
+    return json.loads(data.decode('utf-8'))
+
+def encode_message(message):
+    data = json.dumps(message).encode('utf-8')
+    return header.pack(len(data)) + data
+
+
+@lru_cache(maxsize = 1024)
+def parse_cached(text, url = None):
+    # Parse trees are not modified by rendering, so the same tree can
+    # serve every request for the same text.
+    return parse(Source(text, url = url))
+
+
+class Renderer:
+    """
+    Render requests (see the protocol above) with engines that are
+    built once per flavor and reused. extensions are applied to every
+    engine, before the extensions and variables of each request.
+    Requests can only use the extensions named in allowed_extensions
+    and the engine flavors in flavors.
+    """
+
+    def __init__(self, extensions = [], allowed_extensions = (),
+                 flavors = ('q', 'bare')):
+        self.extensions = extensions
+        self.allowed_extensions = set(allowed_extensions)
+        self.flavors = set(flavors)
+        self.engines = {}
+        self.lock = threading.Lock()
+
+    def engine(self, flavor):
+        if flavor not in self.flavors:
+            raise ValueError("Engine flavor not allowed: %s" % flavor)
+        with self.lock:
+            if flavor not in self.engines:
+                if flavor not in engine_flavors:
+                    raise ValueError("Unknown engine flavor: %s" % flavor)
+                engine = engine_flavors[flavor]()
+                apply_extensions(engine, self.extensions)
+                engine.freeze()
+                self.engines[flavor] = engine
+            return self.engines[flavor]
+
+    def render(self, request):
+        extensions = [ext if isinstance(ext, str) else tuple(ext)
+                      for ext in request.get('extensions', [])]
+        for ext in extensions:
+            name = ext if isinstance(ext, str) else ext[0]
+            if name not in self.allowed_extensions:
+                raise ValueError("Extension not allowed: %s" % name)
+        if request.get('env'):
+            extensions.append(('extend_environment', [request['env']]))
+        template = request.get('template')
+        return full_html(parse_cached(request['source'], request.get('path')),
+                         extensions = extensions,
+                         engine = self.engine(request.get('engine', 'q')),
+                         template = template and parse_cached(template))
+
+    def respond(self, request):
+        try:
+            return {'html': self.render(request)}
+        except Exception as e:
+            return {'error': str(e), 'type': type(e).__name__}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # Clients may send any number of requests on a connection
+        while True:
+            try:
+                request = read_message(self.rfile)
+            except (ProtocolError, ValueError) as e:
+                self.wfile.write(encode_message({'error': str(e),
+                                                 'type': type(e).__name__}))
+                return
+            if request is None:
+                return
+            self.wfile.write(encode_message(self.server.renderer.respond(request)))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, extensions = [], allowed_extensions = (),
+                 flavors = ('q', 'bare')):
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError("%s exists and is not a socket" % path)
+            # A socket left behind by a previous server
+            os.unlink(path)
+        self.path = path
+        self.renderer = Renderer(extensions, allowed_extensions, flavors)
+        super().__init__(path, RequestHandler)
+
+    def server_bind(self):
+        super().server_bind()
+        # Only the user running the server may send it requests
+        os.chmod(self.path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def serve(path, extensions = [], allowed_extensions = (),
+          flavors = ('q', 'bare')):
+    """
+    Serve render requests on the Unix socket at path until
+    interrupted. See Renderer for the arguments.
+    """
+    server = Server(path, extensions, allowed_extensions, flavors)
+    if threading.current_thread() is threading.main_thread():
+        # Remove the socket when killed, too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        lib.shutdown_prefetch_pool()
+
+
+class Client:
+    """
+    Connection to a server started with `quaint serve`.
+
+        with Client('/tmp/quaint.sock') as client:
+            html = client.render("Hello *world*")
+
+    A client holds a single connection and should not be shared
+    between threads without a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.socket = None
+
+    def connect(self):
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(self.path)
+            self.file = self.socket.makefile('rb')
+        return self
+
+    def close(self):
+        if self.socket is not None:
+            self.file.close()
+            self.socket.close()
+            self.socket = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, typ, value, tb):
+        self.close()
+
+    def request(self, request):
+        self.connect()
+        self.socket.sendall(encode_message(request))
+        response = read_message(self.file)
+        if response is None:
+            self.close()
+            raise ProtocolError("The server closed the connection")
+        return response
+
+    def render(self, source, engine = 'q', env = None, extensions = None,
+               template = None, path = None):
+        """
+        Render source to HTML. engine is 'q', 'py' or 'bare', env a
+        dictionary of variables, template the source of a template to
+        use instead of the default one and path the path the source is
+        considered to come from (for includes and relative links).
+        """
+        request = {'source': source, 'engine': engine}
+        if env:
+            request['env'] = env
+        if extensions:
+            request['extensions'] = extensions
+        if template is not None:
+            request['template'] = template
+        if path is not None:
+            request['path'] = path
+        response = self.request(request)
+        if 'error' in response:
+            raise RenderError("%s: %s" % (response['type'], response['error']))
+        return response['html']
@@ -10,3 +10,52 @@ def dedent(code):
     lines2 = [line for line in lines if line]
     nspaces = len(lines2[0]) - len(lines2[0].lstrip())
     return "\n".join([line[nspaces:] for line in lines])
+
+def escape(s, quote = False):
+    s = s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    if quote:
+        s = s.replace('"', "&quot;")
+    return s
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported when one of its
+    attributes is first used. The submodules listed after name are
+    imported along with it. A LazyModule is false if the module cannot
+    be imported.
+    """
+
+    def __init__(self, name, *submodules):
+        self.__dict__['_names'] = (name,) + submodules
+        self.__dict__['_module'] = None
+        self.__dict__['_error'] = None
+
+    def _load(self):
+        if self._module is None:
+            # Failed imports are slow, so they are only attempted once
+            error = self._error
+            if error is not None:
+                raise ImportError(str(error), name = error.name) from error
+            import importlib
+            try:
+                for name in reversed(self._names):
+                    module = importlib.import_module(name)
+            except ImportError as e:
+                self.__dict__['_error'] = e
+                raise
+            self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __bool__(self):
+        try:
+            self._load()
+            return True
+        except ImportError:
+            return False
+
+    def __repr__(self):
+        return '<lazy module %s>' % self._names[0]
@@ -0,0 +1,74 @@
+
+import os
+import time
+
+
+def stat_files(paths):
+    results = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        results[path] = (stat.st_mtime_ns, stat.st_size)
+    return results
+
+def scan(root, extra = ()):
+    """
+    Return a dictionary mapping the absolute path of every file under
+    root, and of every existing file in extra, to its modification
+    time and size.
+    """
+    paths = set(extra)
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+        paths.update(os.path.join(dirpath, name) for name in filenames)
+    return stat_files(paths)
+
+def watch(root, extra = lambda: (), interval = 0.1, quiet = 0.1):
+    """
+    Poll the files under root, and the files returned by extra(), every
+    interval seconds. Yield the set of paths that were created,
+    modified or deleted each time something changes. A burst of
+    changes (e.g. an editor writing several files, or saving twice) is
+    reported at once, after nothing has changed for quiet seconds.
+
+    extra() is called again after each yield, so that the files a
+    rebuild started to depend on are watched from then on.
+    """
+    watched = set(extra())
+    previous = scan(root, watched)
+    while True:
+        time.sleep(interval)
+        current = scan(root, watched)
+        if current == previous:
+            continue
+        while True:
+            time.sleep(quiet)
+            latest = scan(root, watched)
+            if latest == current:
+                break
+            current = latest
+        changed = {path for path in previous.keys() | current.keys()
+                   if previous.get(path) != current.get(path)}
+        previous = current
+        yield changed
+        new = set(extra()) - watched
+        watched |= new
+        previous.update(stat_files(new))
+
+def affected(root, files, changed):
+    """
+    Return the entries (path, templates) of files whose page, or one
+    of whose templates, is or includes or loads data from a path in
+    changed. Paths in files are relative to root.
+    """
+    from .cache import include_cache
+    dependents = set(changed)
+    for path in changed:
+        dependents |= include_cache.dependents(path)
+    results = []
+    for fname, templates in files:
+        paths = [fname] + list(templates.values())
+        if any(os.path.abspath(os.path.join(root, p)) in dependents for p in paths):
+            results.append((fname, templates))
+    return results
@@ -0,0 +1,47 @@
+
+import time
+import asyncio
+import threading
+import pytest
+from quaint import q_engine, parse, full_html, full_html_async
+from quaint.document import make_documents, execute_documents, Interrupted
+from quaint.lib import Raw
+
+
+def slow_engine(calls):
+    engine = q_engine()
+    def slow(engine, node, x, y):
+        calls.append(node)
+        time.sleep(0.02)
+        return Raw("<b>slow</b>")
+    engine['x ^ y'] = slow
+    return engine
+
+
+def test_async_result():
+    engine = slow_engine([])
+    html = asyncio.run(full_html_async("a ^ b", engine = engine, timeout = 10))
+    assert html == full_html("a ^ b", engine = engine)
+
+
+def test_timeout_stops_render():
+    calls = []
+    engine = slow_engine(calls)
+    src = "\n\n".join(["a ^ b"] * 100)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(full_html_async(src, engine = engine, timeout = 0.1))
+    # The thread that was rendering stops soon after the timeout
+    time.sleep(0.1)
+    count = len(calls)
+    time.sleep(0.2)
+    assert len(calls) == count < 100
+
+
+def test_interrupt_generators():
+    interrupt = threading.Event()
+    engine = q_engine()
+    gen = engine(parse("Title\n=====\n\nhello"))
+    interrupt.set()
+    with pytest.raises(Interrupted):
+        execute_documents(gen, make_documents('html', 'sections'),
+                          interrupt = interrupt)
@@ -0,0 +1,36 @@
+
+import os
+import json
+import pytest
+from quaint import bench
+
+
+inputs = bench.real_world_inputs()
+
+
+@pytest.mark.parametrize('name, path, template, extensions', inputs,
+                         ids = [name for name, *_ in inputs])
+def test_real_world_inputs_render(name, path, template, extensions):
+    # The benchmark should time pages, not error reports, except in
+    # the example about errors
+    html = bench.render(path, template, extensions)
+    assert "</html>" in html
+    if name != os.path.join('examples', 'error.py.q'):
+        assert 'class="err_report"' not in html
+
+
+def test_synthetic_corpus_renders(tmp_path):
+    path = bench.write_corpus(str(tmp_path), 5)
+    html = bench.render(path)
+    assert 'class="err_report"' not in html
+    assert "Section 4" in html
+
+
+def test_run():
+    results = bench.run(sizes = (3,), repeat = 1, real_world = False)
+    results = json.loads(bench.dumps(results))
+    [entry] = results['inputs']
+    assert entry['name'] == 'synthetic-3'
+    assert set(entry['phases']) == set(bench.phases) | {'total'}
+    for timing in entry['phases'].values():
+        assert 0 <= timing['min'] <= timing['median'] <= timing['max']
@@ -0,0 +1,132 @@
+
+import os
+import copy
+import pytest
+from quaint import full_html, default_engine, q_engine, lib
+from quaint.operparse import Source
+from quaint.cache import (
+    DataCache, FrozenError, freeze, thaw, data_cache, include_cache
+    )
+
+
+def main(html):
+    return html.split('<div id="main">')[1].split('</div>\n')[0]
+
+def url(path):
+    return 'file:' + str(path)
+
+def touch(path, data):
+    # Changes the size too, in case the mtime has a coarse resolution
+    path.write_text(data)
+    stat = os.stat(path)
+    os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_frozen_data(tmp_path):
+    cache = DataCache()
+    path = tmp_path / 'data.json'
+    path.write_text('{"a": [1, 2]}')
+    data = cache.load(url(path), 'json', lambda: {'a': [1, 2]})
+    with pytest.raises(FrozenError):
+        data['b'] = 3
+    with pytest.raises(FrozenError):
+        data['a'].append(3)
+    mutable = thaw(data)
+    mutable['a'].append(3)
+    assert copy.deepcopy(data) == {'a': [1, 2]}
+    assert cache.load(url(path), 'json', None) == {'a': [1, 2]}
+
+
+def test_lru_eviction(tmp_path):
+    assert data_cache.budget == 64 * 2**20 or 'QUAINT_DATA_CACHE' in os.environ
+    size = freeze(list(range(100)))[1]
+    # Room for two entries
+    cache = DataCache(budget = size * 5 // 2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / ('data%s.json' % i)
+        path.write_text('[]')
+        paths.append(path)
+        cache.load(url(path), 'json', lambda: list(range(100)))
+    assert cache.size <= cache.budget
+    # The least recently used entries were dropped
+    assert not cache.contains(url(paths[0]), 'json')
+    assert cache.contains(url(paths[2]), 'json')
+    # Data larger than the budget is not cached at all
+    cache.load(url(paths[0]), 'json', lambda: list(range(1000)))
+    assert not cache.contains(url(paths[0]), 'json')
+    assert cache.contains(url(paths[2]), 'json')
+
+
+def test_invalidated_on_change(tmp_path):
+    cache = DataCache()
+    path = tmp_path / 'data.json'
+    path.write_text('[1]')
+    assert cache.load(url(path), 'json', lambda: [1]) == [1]
+    assert cache.load(url(path), 'json', lambda: [0]) == [1]
+    touch(path, '[2, 2]')
+    assert cache.load(url(path), 'json', lambda: [2, 2]) == [2, 2]
+    # The entry of the previous version is dropped
+    assert len(cache.entries) == 1
+
+
+def test_shared_between_engines(tmp_path):
+    (tmp_path / 'data.json').write_text('{"x": [1, 2, 3]}')
+    page = str(tmp_path / 'page.py.q')
+    def render(src):
+        return full_html(Source(src, url = page), engine = default_engine())
+    src = "data <= data.json\n\n{id(data)} {len(data['x'])}"
+    first = main(render(src))
+    assert " 3" in first
+    # The second engine gets the same object
+    assert main(render(src)) == first
+    assert "FrozenError" in render("data <= data.json\n\n{data['y'] = 1}")
+    html = render("data <= data.json\n\n"
+                  "{d = thaw(data)}{d['y'] = 1}{sorted(d)} {sorted(data)}")
+    assert "['x', 'y'] ['x']" in html
+
+
+def render_page(path):
+    return full_html(Source(path.read_text(), url = str(path)), engine = q_engine())
+
+
+def test_include_cycle(tmp_path):
+    (tmp_path / 'a.q').write_text("A\n\n{include}: b.q\n")
+    (tmp_path / 'b.q').write_text("B\n\n{include}: a.q\n")
+    html = render_page(tmp_path / 'a.q')
+    assert "IncludeCycle" in html
+    a, b = str(tmp_path / 'a.q'), str(tmp_path / 'b.q')
+    assert " -&gt; ".join([a, b, a]) in html
+
+
+def test_include_parsed_once(tmp_path, monkeypatch):
+    parsed = []
+    lib_parse = lib.parse
+    def parse(text):
+        parsed.append(text)
+        return lib_parse(text)
+    monkeypatch.setattr(lib, 'parse', parse)
+    (tmp_path / 'common.q').write_text("Common text")
+    for name in ('one.q', 'two.q'):
+        (tmp_path / name).write_text("{include}: common.q\n")
+        assert "Common text" in render_page(tmp_path / name)
+    assert parsed == ["Common text"]
+    # A modified file is parsed again
+    touch(tmp_path / 'common.q', "Changed text")
+    assert "Changed text" in render_page(tmp_path / 'one.q')
+    assert parsed == ["Common text", "Changed text"]
+
+
+def test_include_edges(tmp_path):
+    page = tmp_path / 'page.q'
+    page.write_text("{include}: b.q\n")
+    (tmp_path / 'b.q').write_text("B")
+    (tmp_path / 'c.q').write_text("C")
+    render_page(page)
+    assert include_cache.dependents(str(tmp_path / 'b.q')) == {str(page)}
+    # The page no longer includes b.q once it is changed and rendered,
+    # even though forget was not called
+    touch(page, "{include}: c.q\n")
+    render_page(page)
+    assert include_cache.dependents(str(tmp_path / 'b.q')) == set()
+    assert include_cache.dependents(str(tmp_path / 'c.q')) == {str(page)}
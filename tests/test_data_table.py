@@ -0,0 +1,49 @@
+
+import pytest
+from quaint import full_html, q_engine
+from quaint.engine import DataTable
+from quaint.lib import format_html
+
+
+def main(html):
+    return html.split('<div id="main">')[1].split('</div>\n')[0]
+
+def render(src, **env):
+    engine = q_engine()
+    engine.environment.update(env)
+    return main(full_html(src, engine = engine))
+
+
+def people():
+    yield {'name': 'Alice', 'age': 31}
+    yield {'name': 'Bob <b>', 'age': 27}
+
+
+@pytest.mark.parametrize('rows', [list(people()), people()],
+                         ids = ['list', 'iterator'])
+def test_rendered_twice(rows):
+    html = render("x <- [{data_table}: people]\n\n{x} {x}", people = rows)
+    assert html.count("<td>Alice</td><td>31</td>") == 2
+    assert html.count("<td>Bob &lt;b&gt;</td>") == 2
+
+
+def test_generate_twice():
+    table = DataTable(iter([['a', 'b'], [1, 2]]), header = True)
+    first = format_html(table)
+    assert first == format_html(table)
+    assert first == "<table><tr><th>a</th><th>b</th></tr><tr><td>1</td><td>2</td></tr></table>"
+
+
+def test_mixed_rows():
+    table = DataTable([[1, 2], {'k': 3, 'l': 4}, {'l': 5}])
+    assert format_html(table) == ("<table><tr><td>1</td><td>2</td></tr>"
+                                  "<tr><td>3</td><td>4</td></tr>"
+                                  "<tr><td></td><td>5</td></tr></table>")
+
+
+def test_binding_options():
+    html = render("{data_table}: people [columns = age, name] [header = Age, Name]",
+                  people = list(people()))
+    assert "<tr><th>Age</th><th>Name</th></tr><tr><td>31</td><td>Alice</td></tr>" in html
+    html = render("{data_table}: rows [header = first]", rows = [['a'], [1]])
+    assert "<tr><th>a</th></tr><tr><td>1</td></tr>" in html
@@ -0,0 +1,40 @@
+
+from quaint import q_engine, parse
+from quaint.interface import evaluate
+from quaint.document import make_documents, execute_documents, prepare_documents
+
+
+def render(src, targets = None):
+    docs = make_documents('html', 'meta', 'links', 'sections', 'errors',
+                          'css', 'js', 'xlinks')
+    evaluate(parse(src), q_engine(), docs, targets)
+    return docs
+
+
+def test_targets_include_dependencies():
+    src = """{meta}:
+  title: Hello
+
+Title is [{meta}: title], see [this]::intro and {nope}
+
+Intro
+=====
+"""
+    html = render(src, ['html'])['html'].format_html()
+    assert "Title is Hello" in html
+    assert '<a href="#intro">this</a>' in html
+    assert 'href="#__ERR_1">E1</a>' in html
+    assert render(src)['html'].format_html() == html
+
+
+def test_execute_documents_order():
+    # Nothing here depends on another document, so execute_documents
+    # takes its fast path, which must agree with prepare_documents
+    gen = q_engine()(parse("Hello\n\n* a\n* b"))
+    for targets in (None, ['html'], ['css', 'html']):
+        docs = make_documents('html', 'css', 'js', 'meta')
+        docset = targets and {docs[name] for name in targets}
+        expected = [doc for doc, _ in prepare_documents(gen, docs, targets = docset)]
+        assert execute_documents(gen, docs, targets) == expected
+    assert expected == [docs['html'], docs['css']]
+    assert "<li> a</li>" in docs['html'].format_html()
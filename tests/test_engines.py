@@ -0,0 +1,51 @@
+
+import pickle
+from quaint import full_html, q_engine, builders
+from quaint import engine as mod_engine
+from quaint.lib import Raw
+
+
+def main(html):
+    return html.split('<div id="main">')[1].split('</div>\n')[0]
+
+
+def test_engines_from_one_snapshot():
+    first = q_engine()
+    second = q_engine()
+    first.environment['who'] = 'first'
+    first['x ^ y'] = lambda engine, node, x, y: Raw("<b>linked</b>")
+    assert 'who' not in second.environment
+    assert "<b>linked</b>" in main(full_html("a ^ b {who}", engine = first))
+    html = main(full_html("a ^ b {who}", engine = second))
+    assert "<b>linked</b>" not in html
+    assert "first" not in html
+    # A third engine does not see the changes either
+    assert "<b>linked</b>" not in main(full_html("a ^ b", engine = q_engine()))
+
+
+def test_first_character_is_per_rule():
+    first = q_engine()
+    second = q_engine()
+    first.register('shed x', lambda engine, node, x: x, 'Q')
+    second.register('shed x', lambda engine, node, x: x)
+    [(rule, _)] = first.ctors['Q']
+    assert rule.first_character == 'Q'
+    # The pattern compiled for both is shared, but not the rule
+    assert not second.ctors.get('Q')
+
+
+def test_bad_pattern_cache(tmp_path, monkeypatch):
+    path = tmp_path / 'patterns'
+    # Unpickling this raises AttributeError
+    path.write_bytes(b"cquaint.engine\nno_such_attribute\n.")
+    assert not mod_engine.load_pattern_trees(str(path))
+    for data in (b"garbage", pickle.dumps([1, 2]), pickle.dumps({'trees': 1})):
+        path.write_bytes(data)
+        assert not mod_engine.load_pattern_trees(str(path))
+
+    # Building an engine replaces the file with a valid one
+    monkeypatch.setenv('QUAINT_PATTERN_CACHE', str(path))
+    monkeypatch.setattr(builders, '__snapshots', {})
+    monkeypatch.setattr(builders, '__pattern_trees_loaded', False)
+    assert "Hello" in full_html("Hello", engine = q_engine())
+    assert mod_engine.load_pattern_trees(str(path))
@@ -0,0 +1,52 @@
+
+from quaint import full_html, default_engine, q_engine
+from quaint.lib import Raw
+
+
+def main(html):
+    return html.split('<div id="main">')[1].split('</div>\n')[0]
+
+
+def test_expansion_with_eval_is_not_reused():
+    src = """{import itertools; counter = itertools.count(1)}
+
+x <- {next(counter)}
+
+a {x} b {x} c {x}
+"""
+    assert "a  1 b  2 c  3" in main(full_html(src, engine = default_engine()))
+
+
+def test_expansion_is_reused():
+    src = """x <- __hello *there*
+
+{x} {x} {x}
+"""
+    html = main(full_html(src, engine = q_engine()))
+    assert html.count("<strong>hello</strong>") == 3
+
+
+def test_expansion_after_variable_change():
+    engine = q_engine()
+
+    def sep(engine, node, x, y):
+        return Raw("%s%s%s" % (x.raw(), engine.environment['sep'], y.raw()))
+
+    def set_sep(engine, node, x):
+        # Not one of the usual ways to set a variable
+        engine.environment['sep'] = x.raw()
+        return Raw("")
+
+    engine['x ^ y'] = sep
+    engine.environment.update(sep = "+", set_sep = set_sep)
+    src = """v <- a ^ b
+
+{v} {v}
+
+{set_sep}: to
+
+{v}
+"""
+    html = main(full_html(src, engine = engine))
+    assert html.count("a+b") == 2
+    assert html.count("atob") == 1
@@ -0,0 +1,115 @@
+
+import threading
+import http.server
+import urllib.parse
+import pytest
+from quaint.fetcher import Fetcher, user_agent
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.log.append((self.path, dict(self.headers)))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            body = server.body
+            self.send_response(200)
+            if server.etag:
+                self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        if server.drop:
+            # Close the connection without telling the client, like a
+            # server dropping idle connections
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.log = []
+    server.body = b"hello"
+    server.etag = True
+    server.drop = False
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    server.url = 'http://127.0.0.1:%s' % server.server_port
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse = True)
+def no_proxy(monkeypatch):
+    for name in ('http_proxy', 'https_proxy', 'no_proxy', 'all_proxy'):
+        monkeypatch.delenv(name, raising = False)
+        monkeypatch.delenv(name.upper(), raising = False)
+
+
+def test_fetch(server):
+    fetcher = Fetcher()
+    assert fetcher.fetch(server.url + '/a?x=1') == "hello"
+    path, headers = server.log[0]
+    assert path == '/a?x=1'
+    assert headers['User-Agent'] == user_agent
+
+
+def test_revalidate(server, tmp_path):
+    fetcher = Fetcher(cache_dir = str(tmp_path))
+    assert fetcher.fetch(server.url + '/a') == "hello"
+    server.body = b"changed"
+    assert fetcher.fetch(server.url + '/a') == "hello"
+    assert server.log[1][1]['If-None-Match'] == '"v1"'
+    # A new fetcher finds the entry on disk
+    assert Fetcher(cache_dir = str(tmp_path)).fetch(server.url + '/a') == "hello"
+
+
+def test_no_cache_without_etag(server, tmp_path):
+    server.etag = False
+    fetcher = Fetcher(cache_dir = str(tmp_path))
+    fetcher.fetch(server.url + '/a')
+    fetcher.fetch(server.url + '/a')
+    assert 'If-None-Match' not in server.log[1][1]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_unwritable_cache(server, tmp_path):
+    # The cache directory is a file, so that entries cannot be stored
+    path = tmp_path / 'cache'
+    path.write_text("")
+    assert Fetcher(cache_dir = str(path)).fetch(server.url + '/a') == "hello"
+
+
+def test_retry_dropped_connection(server):
+    server.drop = True
+    fetcher = Fetcher()
+    assert fetcher.fetch(server.url + '/a') == "hello"
+    server.body = b"again"
+    assert fetcher.fetch(server.url + '/b') == "again"
+    assert [path for path, _ in server.log] == ['/a', '/b']
+
+
+def test_proxy(server, monkeypatch):
+    monkeypatch.setenv('http_proxy', server.url)
+    fetcher = Fetcher()
+    # The proxy receives the full URL of the resource
+    assert fetcher.fetch('http://example.invalid/a') == "hello"
+    path, headers = server.log[0]
+    assert urllib.parse.urlsplit(path).netloc == 'example.invalid'
+    assert headers['User-Agent'] == user_agent
+
+
+def test_no_proxy(server, monkeypatch):
+    monkeypatch.setenv('http_proxy', 'http://127.0.0.1:1')
+    monkeypatch.setenv('no_proxy', '127.0.0.1')
+    assert Fetcher().fetch(server.url + '/a') == "hello"
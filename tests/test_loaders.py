@@ -0,0 +1,73 @@
+
+import functools
+import threading
+import http.server
+import pytest
+from quaint import full_html, q_engine
+from quaint.operparse import Source
+from quaint.lib import URLLines, StreamLoader, resolve_url
+
+
+def main(html):
+    return html.split('<div id="main">')[1].split('</div>\n')[0]
+
+def render(src, path):
+    return main(full_html(Source(src, url = str(path)), engine = q_engine()))
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    for name in ('http_proxy', 'HTTP_PROXY'):
+        monkeypatch.delenv(name, raising = False)
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler,
+                                directory = str(tmp_path))
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield 'http://127.0.0.1:%s' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def test_resolve_url():
+    engine = q_engine()
+    engine.environment['__file__'] = '/site/page.q'
+    assert resolve_url('http://example.com/a.csv', engine) == 'http://example.com/a.csv'
+    assert resolve_url('file:/data/a.csv', engine) == 'file:/data/a.csv'
+    assert resolve_url('a.csv', engine) == 'file:/site/a.csv'
+    # Windows drives are paths, not schemes
+    for path in ('C:\\data.csv', 'c:/data.csv'):
+        assert not resolve_url(path, engine).startswith(path)
+        assert resolve_url(path, engine).startswith('file:')
+
+
+def test_url_lines(tmp_path, server):
+    (tmp_path / 'lines.txt').write_text("one\ntwo\nthree")
+    (tmp_path / 'empty.txt').write_text("")
+    lines = URLLines('file:' + str(tmp_path / 'lines.txt'))
+    assert list(lines) == ["one\n", "two\n", "three"]
+    # Each iteration reads the file anew
+    (tmp_path / 'lines.txt').write_text("four\n")
+    assert list(lines) == ["four\n"]
+    assert list(URLLines('file:' + str(tmp_path / 'empty.txt'))) == []
+    assert list(URLLines(server + '/lines.txt')) == ["four\n"]
+    loader = StreamLoader(server + '/lines.txt', lambda lines: map(str.upper, lines))
+    assert list(loader) == ["FOUR\n"] == list(loader)
+
+
+def test_csv_stream(tmp_path):
+    (tmp_path / 'people.csv').write_text("name, age\nAlice, 31\nBob, 27\n")
+    html = render("rows <= csv-stream :: people.csv\n\n"
+                  "{data_table}: rows [header = first]", tmp_path / 'page.q')
+    assert ("<tr><th>name</th><th>age</th></tr>"
+            "<tr><td>Alice</td><td>31</td></tr>") in html
+
+
+def test_jsonl(tmp_path, server):
+    (tmp_path / 'people.jsonl').write_text('{"name": "Alice"}\n\n{"name": "Bob"}\n')
+    html = render("rows <= people.jsonl\n\n{data_table}: rows", tmp_path / 'page.q')
+    assert "<tr><td>Alice</td></tr><tr><td>Bob</td></tr>" in html
+    html = render("rows <= jsonl :: %s/people.jsonl\n\n{data_table}: rows" % server,
+                  tmp_path / 'page.q')
+    assert "<tr><td>Alice</td></tr><tr><td>Bob</td></tr>" in html
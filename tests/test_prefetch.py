@@ -0,0 +1,105 @@
+
+import time
+import threading
+import http.server
+import pytest
+from quaint import full_html, q_engine, lib
+from quaint.operparse import Source
+from quaint.fetcher import Fetcher, set_fetcher, get_fetcher
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.most = max(server.most, server.active)
+        time.sleep(0.2)
+        with server.lock:
+            server.active -= 1
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'{"path": "%s"}' % self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for name in ('http_proxy', 'HTTP_PROXY', 'no_proxy', 'NO_PROXY'):
+        monkeypatch.delenv(name, raising = False)
+    fetcher = get_fetcher()
+    set_fetcher(Fetcher())
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.active = server.most = 0
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    server.url = 'http://127.0.0.1:%s' % server.server_port
+    yield server
+    server.shutdown()
+    server.server_close()
+    set_fetcher(fetcher)
+
+
+def render(src, path):
+    html = full_html(Source(src, url = str(path)), engine = q_engine())
+    return html.split('<div id="main">')[1].split('</div>\n')[0]
+
+
+def test_concurrent_prefetch(server, tmp_path):
+    names = "abcd"
+    src = "".join("%s <= %s/%s.json\n" % (name, server.url, name) for name in names)
+    src += "\n" + " ".join("{%s}" % name for name in names)
+    start = time.perf_counter()
+    html = render(src, tmp_path / 'page.q')
+    # The four requests take 0.2s each, but run at the same time
+    assert time.perf_counter() - start < 0.6
+    assert server.most > 1
+    for name in names:
+        assert "/%s.json" % name in html
+    # load_in_var used the prefetched data instead of fetching again
+    assert sorted(server.requests) == ["/%s.json" % name for name in names]
+
+
+def test_prefetch_files(tmp_path):
+    (tmp_path / 'data.json').write_text('{"answer": 42}')
+    (tmp_path / 'other.yaml').write_text('- 1\n- 2\n')
+    html = render("x <= data.json\ny <= yaml::other.yaml\n\n{x} {y}",
+                  tmp_path / 'page.q')
+    assert "{'answer': 42}" in html
+    assert "[1, 2]" in html
+
+
+def test_failed_prefetch(server, tmp_path):
+    src = ("x <= %s/missing.json\n"
+           "y <= %s/present.json\n\n{y}" % (server.url, server.url))
+    html = render(src, tmp_path / 'page.q')
+    # The error is shown where the file is loaded, and the other
+    # loads are not affected
+    assert 'class="error">x &lt;= ' in html
+    assert "/present.json" in html
+
+
+def test_shutdown_prefetch_pool(tmp_path):
+    (tmp_path / 'data.json').write_text('[1]')
+    render("x <= data.json\n\n{x}", tmp_path / 'page.q')
+    pool = lib.prefetch_pool()
+    lib.shutdown_prefetch_pool()
+    assert pool._shutdown
+    # A new pool is started when needed
+    (tmp_path / 'more.json').write_text('[2]')
+    assert "[2]" in render("x <= more.json\n\n{x}", tmp_path / 'page.q')
+    assert lib.prefetch_pool() is not pool
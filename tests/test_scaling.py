@@ -0,0 +1,85 @@
+
+import os
+import sys
+import importlib.util
+import pytest
+from quaint import parse
+from quaint.document import TextDocument, toposort
+
+
+def load_scaling():
+    path = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'scaling.py')
+    spec = importlib.util.spec_from_file_location('scaling', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('shape', ['definitions', 'links', 'list', 'sections', 'table'])
+def test_scaling(shape):
+    # Like benchmarks/scaling.py with smaller sizes
+    scaling = load_scaling()
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(10000)
+    try:
+        results = scaling.check_shape(shape, [50, 100, 200, 400], 2, 0.15)
+    finally:
+        sys.setrecursionlimit(limit)
+    failures = {phase: exponent for phase, (exponent, ok) in results.items() if not ok}
+    assert not failures
+
+
+def test_aggregate_chain():
+    assert repr(parse("p1\n\np2\n\np3")) == "#BlockOp:B['p1', 'p2', 'p3']"
+    # Each paragraph break aggregates into the same operator, without
+    # recursing once per paragraph
+    n = 5000
+    ptree = parse("\n\n".join("p%s" % i for i in range(n)))
+    assert len(ptree.args) == n
+    assert ptree.args[0] == 'p0' and ptree.args[-1] == 'p%s' % (n - 1)
+
+
+def test_ternary_chain():
+    assert (repr(parse("a ? b : c ? d : e"))
+            == "#InlineOp:?['a', #InlineOp::['b', #InlineOp:?['c', #InlineOp::['d', 'e']]]]")
+    ptree = parse(" : ".join("c%s ? v%s" % (i, i) for i in range(200)))
+    depth = 0
+    while not isinstance(ptree, str):
+        ptree = ptree.args[-1]
+        depth += 1
+    assert ptree == 'v199'
+    assert depth == 399
+
+
+def test_text_document():
+    doc = TextDocument()
+    for i in range(1000):
+        doc.add(str(i))
+    expected = "".join(map(str, range(1000)))
+    assert doc.data == expected
+    assert doc.parts == [expected]
+    doc.add("!")
+    assert doc.data == expected + "!"
+    clone = doc.clone()
+    clone.add("?")
+    assert doc.data == expected + "!"
+    assert clone.data == expected + "!?"
+    doc.data = "reset"
+    doc.add("s")
+    assert doc.data == "resets"
+
+
+def test_toposort():
+    pred = {'html': {'sections', 'links'}, 'links': {'sections'},
+            'sections': set(), 'css': set()}
+    order = toposort(pred)
+    assert sorted(order) == sorted(pred)
+    for entry, prereqs in pred.items():
+        assert all(order.index(p) < order.index(entry) for p in prereqs)
+    # A long chain
+    n = 10000
+    order = toposort({i: {i - 1} if i else set() for i in reversed(range(n))})
+    assert order == list(range(n))
+    with pytest.raises(Exception):
+        toposort({'a': {'b'}, 'b': {'a'}, 'c': set()})
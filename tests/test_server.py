@@ -0,0 +1,69 @@
+
+import os
+import stat
+import socket
+import threading
+import pytest
+from quaint.server import Server, Client, RenderError
+
+
+def start(path, **options):
+    server = Server(path, **options)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    return server, thread
+
+def stop(server, thread):
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'quaint.sock')
+    server, thread = start(path)
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        with Client(path) as client:
+            html = client.render("Hello *world*", env = {'title': 'Hi'})
+            assert "Hello" in html
+            # Several requests on the same connection
+            assert "Bye" in client.render("Bye")
+    finally:
+        stop(server, thread)
+    assert not os.path.exists(path)
+
+
+def test_stale_socket(tmp_path):
+    path = str(tmp_path / 'quaint.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    server, thread = start(path)
+    try:
+        with Client(path) as client:
+            assert "Hello" in client.render("Hello")
+    finally:
+        stop(server, thread)
+
+
+def test_not_a_socket(tmp_path):
+    path = tmp_path / 'quaint.sock'
+    path.write_text("data")
+    with pytest.raises(FileExistsError):
+        Server(str(path))
+    assert path.read_text() == "data"
+
+
+def test_restrictions(tmp_path):
+    path = str(tmp_path / 'quaint.sock')
+    server, thread = start(path, allowed_extensions = ['siteroot'])
+    try:
+        with Client(path) as client:
+            with pytest.raises(RenderError, match = "not allowed"):
+                client.render("x", extensions = ['os.system'])
+            with pytest.raises(RenderError, match = "not allowed"):
+                client.render("{1 + 1}", engine = 'py')
+            assert "Hello" in client.render("Hello", extensions = [['siteroot', ['/']]])
+    finally:
+        stop(server, thread)
@@ -0,0 +1,71 @@
+
+import os
+from quaint import site, site_stream, default_engine, parse
+from quaint.operparse import Source
+from quaint.interface import fullhtml_template
+from quaint.watch import affected
+
+
+pages = {
+    'intro.q': "{meta}:\n  title: Intro\n\nIntro\n=====\n\nHello",
+    'data.q': "{meta}:\n  title: Data\n\nx <= numbers.json\n\n{x}",
+    'index.q': ('{genfrom("globalinfo")}:\n'
+                '  {", ".join(docs["meta"].get("title", "?")'
+                ' for _, docs in sorted(globalinfo.data.items()))}\n'),
+    }
+
+
+def write_pages(root, names):
+    (root / 'numbers.json').write_text('[1, 2, 3]')
+    for name in names:
+        (root / name).write_text(pages[name])
+
+def loader(root, loads = None):
+    def load(name):
+        if loads is not None:
+            loads.append(name)
+        path = str(root / name)
+        with open(path) as f:
+            return parse(Source(f.read(), url = path)), fullhtml_template()
+    return load
+
+def render_stream(root, names, **options):
+    return {path: doc.format_html()
+            for path, doc in site_stream(names, loader(root),
+                                         engine = default_engine(), **options)}
+
+
+def test_site_stream_matches_site(tmp_path):
+    names = list(pages)
+    write_pages(tmp_path, names)
+    load = loader(tmp_path)
+    files = site([(name, *load(name)) for name in names], engine = default_engine())
+    expected = {path: doc.format_html() for path, doc in files.items()}
+    assert "Data, ?, Intro" in expected['index']
+    readers = set()
+    assert render_stream(tmp_path, names, readers = readers) == expected
+    assert readers == {'index.q'}
+    assert render_stream(tmp_path, names, globalinfo = True) == expected
+
+
+def test_site_stream_without_readers(tmp_path):
+    names = ['intro.q', 'data.q']
+    write_pages(tmp_path, names)
+    loads = []
+    results = list(site_stream(names, loader(tmp_path, loads),
+                               engine = default_engine()))
+    # No page reads globalinfo, so there is no first pass
+    assert loads == names
+    assert [path for path, _ in results] == ['intro', 'data']
+
+
+def test_watch_affected(tmp_path):
+    names = ['intro.q', 'data.q']
+    write_pages(tmp_path, names)
+    list(site_stream(names, loader(tmp_path), engine = default_engine()))
+    files = [(name, {}) for name in names]
+    changed = {str(tmp_path / 'numbers.json')}
+    assert affected(str(tmp_path), files, changed) == [('data.q', {})]
+    changed = {str(tmp_path / 'intro.q')}
+    assert affected(str(tmp_path), files, changed) == [('intro.q', {})]
+    assert affected(str(tmp_path), files, {str(tmp_path / 'other')}) == []
@@ -0,0 +1,73 @@
+
+import gc
+from quaint import parse, default_engine, site_stream
+from quaint import engine as mod_engine
+from quaint.operparse import Source
+
+
+def build(pages, template, engine = None):
+    # pages maps paths to sources, all rendered with template
+    def load(name):
+        return parse(Source(pages[name], url = name)), template
+    results = dict(site_stream(list(pages), load,
+                               engine = engine or default_engine(),
+                               globalinfo = False))
+    return {path: results[path[:-len('.q')]].data for path in pages}
+
+
+def count_calls(monkeypatch, name):
+    calls = []
+    f = getattr(mod_engine, name)
+    def wrapper(*args):
+        calls.append(args)
+        return f(*args)
+    monkeypatch.setattr(mod_engine, name, wrapper)
+    return calls
+
+
+def test_template_with_evals(monkeypatch):
+    calls = count_calls(monkeypatch, 'compile_skeleton')
+    template = parse('p .. Page: {__file__.split("/")[-1]}\n'
+                     '{insert_document}: main')
+    results = build({'d/a.q': "A", 'd/b.q': "B", 'd/c.q': "C"}, template)
+    for name in "abc":
+        html = results['d/%s.q' % name]
+        assert "Page: %s.q" % name in html
+        assert name.upper() in html
+    assert not calls
+
+
+def test_template_rules():
+    template = parse('{engine["x ^ y"] = lambda engine, node, x, y: Raw("<b>up</b>")}\n'
+                     '{insert_document}: main')
+    results = build({'d/a.q': "a ^ b", 'd/b.q': "c ^ d"}, template)
+    assert all("<b>up</b>" in html for html in results.values())
+
+
+def test_static_template_per_directory(monkeypatch):
+    calls = count_calls(monkeypatch, 'static_template')
+    template = parse('title .. [{meta}: title]\n{insert_document}: main')
+    pages = {path: "{meta}:\n  title: T%s\n\nbody %s" % (i, i)
+             for i, path in enumerate(['x/a.q', 'x/b.q', 'y/c.q', 'y/d.q'])}
+    results = build(pages, template)
+    for i, path in enumerate(pages):
+        assert "T%s" % i in results[path]
+        assert "body %s" % i in results[path]
+    # Compiled once for each directory
+    assert len([node for engine, node in calls if node is template]) == 2
+
+
+def test_repeated_builds():
+    engine = default_engine()
+    pages = {'d/a.q': "A", 'd/b.q': "B"}
+    template = parse('p .. First\n{insert_document}: main')
+    first = build(pages, template, engine)
+    assert first == build(pages, template, engine)
+    for i in range(20):
+        # New templates never pick up the skeleton of an old one, even
+        # if they get its id
+        del template
+        gc.collect()
+        template = parse('p .. Version %s\n{insert_document}: main' % i)
+        results = build(pages, template, engine)
+        assert all("Version %s" % i in html for html in results.values())
@@ -0,0 +1,25 @@
+
+import importlib
+import pytest
+from quaint.util import LazyModule
+
+
+def test_lazy_module(monkeypatch):
+    imported = []
+    import_module = importlib.import_module
+    def counting(name):
+        imported.append(name)
+        return import_module(name)
+    monkeypatch.setattr(importlib, 'import_module', counting)
+
+    missing = LazyModule('quaint_no_such_module')
+    assert not missing
+    assert not missing
+    with pytest.raises(ImportError):
+        missing.anything
+    # The failed import was only attempted once
+    assert imported == ['quaint_no_such_module']
+
+    json = LazyModule('json')
+    assert json and json.loads('[1]') == [1]
+    assert imported == ['quaint_no_such_module', 'json']